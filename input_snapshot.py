@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+.npz snapshots of parsed input tables, shared by squirrel_2.0.0.py (input json)
+and main.py (input workbook).
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class InputSnapshot:
+    """.npz snapshot of the normalised input tables of one source file.
+
+    Stored in directory under a name derived from the source path, with the
+    source mtime, size and sha256. load() returns the tables while the source
+    keeps its mtime and size (or, if it was only touched, its content), and
+    None otherwise; the caller then parses the source and save()s the tables.
+    String columns are stored as unique values and int32 codes, other object
+    columns as type-tagged strings, so no pickling is involved.
+    """
+
+    def __init__(self, source, directory=".squirrel_snapshots"):
+        self.source = os.path.abspath(source)
+        self.directory = directory
+        self.path = os.path.join(directory, hashlib.sha256(
+            self.source.encode()).hexdigest()[:16] + ".npz")
+
+    def source_hash(self):
+        digest = hashlib.sha256()
+        with open(self.source, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def tag(self, value):
+        if value is None:
+            return "n"
+        if isinstance(value, bool):
+            return "b" + str(int(value))
+        if isinstance(value, (int, np.integer)):
+            return "i" + str(value)
+        if isinstance(value, (float, np.floating)):
+            return "f" + repr(float(value))
+        if isinstance(value, str):
+            return "s" + value
+        if isinstance(value, datetime.datetime):
+            return "d" + value.isoformat()
+        if isinstance(value, datetime.time):
+            return "t" + value.isoformat()
+        raise TypeError("cannot snapshot {0!r}".format(value))
+
+    def untag(self, text):
+        kind, value = text[:1], text[1:]
+        if kind == "n":
+            return None
+        if kind == "b":
+            return value == "1"
+        if kind == "i":
+            return int(value)
+        if kind == "f":
+            return float(value)
+        if kind == "d":
+            return pd.Timestamp(value)
+        if kind == "t":
+            return datetime.time.fromisoformat(value)
+        return value
+
+    def encode(self, column):
+        "(kind, arrays) of one column"
+        if column.dtype != object:
+            return "array", [column.to_numpy()]
+        values = column.tolist()
+        if all(value is None or isinstance(value, str) for value in values):
+            # repeated GUIDs and names are stored once, None is code -1
+            codes, uniques = pd.factorize(column)
+            return "str", [np.array(uniques.tolist(), dtype=str), codes.astype(np.int32)]
+        return "tagged", [np.array([self.tag(value) for value in values], dtype=str)]
+
+    def decode(self, kind, arrays):
+        if kind == "array":
+            return arrays[0]
+        if kind == "str":
+            return np.append(arrays[0].astype(object), None)[arrays[1]]
+        return np.array([self.untag(text) for text in arrays[0].tolist()], dtype=object)
+
+    def load(self):
+        "(tables, extras) of the snapshot, or None if there is none for the current source"
+        if not os.path.exists(self.path):
+            return None
+        stat = os.stat(self.source)
+        with np.load(self.path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            touched = (meta["mtime_ns"], meta["size"]) != (stat.st_mtime_ns, stat.st_size)
+            if touched and meta["sha256"] != self.source_hash():
+                return None
+            tables = {}
+            for name, columns in meta["tables"].items():
+                tables[name] = pd.DataFrame({
+                    column: self.decode(kind, [arrays["{0}.{1}.{2}".format(name, n, i)]
+                                               for i in range(count)])
+                    for n, (column, kind, count) in enumerate(columns)})
+        if touched:
+            self.save(tables, meta["extras"], meta["sha256"])
+        return tables, meta["extras"]
+
+    def save(self, tables, extras, sha256=None):
+        "Snapshot tables ({name: DataFrame}) and json-able extras; skipped if a column cannot be stored"
+        stat = os.stat(self.source)
+        meta = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                "sha256": sha256 or self.source_hash(), "extras": extras, "tables": {}}
+        arrays = {}
+        try:
+            for name, df in tables.items():
+                meta["tables"][name] = []
+                for n, column in enumerate(df.columns):
+                    kind, column_arrays = self.encode(df[column])
+                    meta["tables"][name].append((column, kind, len(column_arrays)))
+                    for i, array in enumerate(column_arrays):
+                        arrays["{0}.{1}.{2}".format(name, n, i)] = array
+        except TypeError as e:
+            print("Input snapshot skipped: {0}".format(e))
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with open(tmp, "wb") as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, self.path)
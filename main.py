@@ -7,6 +7,10 @@ from docplex.mp.model import Model
 from docplex.util.environment import get_environment
 from functools import reduce
 import numpy as np
+import json
+import sys
+from docplex.mp.constants import EffortLevel, WriteLevel
+from input_snapshot import InputSnapshot
 
 # ----------------------------------------------------------------------------
 # Initialize the problem data
@@ -53,9 +57,16 @@ TShiftConstraints = namedtuple(
     ],
 )
 TRange = namedtuple("TRange", ["From", "To"])
+TCandidateShift = namedtuple(
+    "TCandidateShift",
+    ["ContactID", "ObjectTimeID", "Start", "End", "Breaks", "Working", "OnShift"]
+)
 
 file_name = "./Data/Squirrel_Optimization.xlsx"
-excel_data_file = pd.ExcelFile(file_name)
+SHEETS = ["Vacancy", "Vacancy Object Time", "Team Member Measurement", "Team Member Worksite Preference",
+          "Team Member Availability", "Team Member Shift Preference", "Shift Constraints"]
+# .npz snapshots of the parsed sheets (None always parses the workbook)
+SNAPSHOT_DIR = ".squirrel_snapshots"
 
 PERIOD_MINUTE = 30
 
@@ -67,6 +78,17 @@ MIN_SHIFT_LENGTH = int(4.0 * 60)
 SECONDARY_BREAK_TIME = int(8.0 * 60)
 
 START_TIMES_LIST = list(t*60 for t in [5, 6, 8, 10, 13, 14, 15, 16])
+SHIFT_DURATION_LIST = list(
+    # int(t*60) for t in ([0, 4] + [4+i/float(60/PERIOD_MINUTE) for i in range(1, int(6*float(60/PERIOD_MINUTE))+1)])
+    int(t*60) for t in ([0, 4, 6, 8, 11])
+)
+
+# "moment": start/end/break integer vars checked at every moment with logical binaries
+# "pattern": one binary per candidate shift (start x duration x breaks) with a fixed coverage
+FORMULATION = "moment"
+
+
+def getDate(x): return int(x / (24 * 60))
 
 
 def lookup(lst, func):
@@ -77,38 +99,45 @@ def lookup(lst, func):
             return i
 
 
-def load_data(model, excel, verbose):
+def read_sheets(source=file_name):
+    "The SHEETS of the workbook, from its InputSnapshot while the workbook is unchanged"
+    snapshot = InputSnapshot(source, SNAPSHOT_DIR) if SNAPSHOT_DIR is not None else None
+    loaded = snapshot.load() if snapshot is not None else None
+    if loaded is not None:
+        return loaded[0]
+    excel = pd.ExcelFile(source)
+    sheets = {name: excel.parse(name) for name in SHEETS}
+    if snapshot is not None:
+        snapshot.save(sheets, {})
+    return sheets
+
 
-    df_vacancy_detail = excel.parse("Vacancy")
-    df_vacancy_objectTime = excel.parse("Vacancy Object Time")
-    df_teamMember_measurement = excel.parse("Team Member Measurement")
-    df_teamMember_worksiteReference = excel.parse(
-        "Team Member Worksite Preference")
-    df_teamMember_availability = excel.parse("Team Member Availability")
-    df_teamMember_shiftReference = excel.parse("Team Member Shift Preference")
-    df_shift_constraints = excel.parse("Shift Constraints")
+def load_data(model, sheets, verbose):
 
-    anchor_date = df_vacancy_detail["StartDate"][0]
+    df_vacancy_detail = sheets["Vacancy"]
+    df_vacancy_objectTime = sheets["Vacancy Object Time"]
+    df_teamMember_measurement = sheets["Team Member Measurement"]
+    df_teamMember_worksiteReference = sheets["Team Member Worksite Preference"]
+    df_teamMember_availability = sheets["Team Member Availability"]
+    df_teamMember_shiftReference = sheets["Team Member Shift Preference"]
+    df_shift_constraints = sheets["Shift Constraints"]
+
+    anchor_date = pd.Timestamp(df_vacancy_detail["StartDate"][0])
     # print(anchor_date)
-    def date2num(dt): return int((dt - anchor_date).total_seconds() / 60)
+
+    def date2num(column):
+        "Whole minutes since anchor_date of a whole column"
+        minutes = (pd.to_datetime(column).values - np.datetime64(anchor_date)) / np.timedelta64(1, "m")
+        return np.trunc(minutes).astype(np.int64)
 
     model.num2date = lambda n: anchor_date + datetime.timedelta(
         days=int(n / (60 * 24)), hours=int((n % (60 * 24))) / 60
     )
-    # print(list(map(date2num, df_vacancy_objectTime["DateFrom"])))
 
-    df_vacancy_objectTime.loc[:, "DateFrom"] = list(
-        map(date2num, df_vacancy_objectTime["DateFrom"])
-    )
-    df_vacancy_objectTime.loc[:, "DateTo"] = list(
-        map(date2num, df_vacancy_objectTime["DateTo"])
-    )
-    df_teamMember_availability.loc[:, "TimeFrom"] = list(
-        map(date2num, df_teamMember_availability["TimeFrom"])
-    )
-    df_teamMember_availability.loc[:, "TimeTo"] = list(
-        map(date2num, df_teamMember_availability["TimeTo"])
-    )
+    df_vacancy_objectTime["DateFrom"] = date2num(df_vacancy_objectTime["DateFrom"])
+    df_vacancy_objectTime["DateTo"] = date2num(df_vacancy_objectTime["DateTo"])
+    df_teamMember_availability["TimeFrom"] = date2num(df_teamMember_availability["TimeFrom"])
+    df_teamMember_availability["TimeTo"] = date2num(df_teamMember_availability["TimeTo"])
 
     del df_teamMember_availability["Team Member"]
     del df_teamMember_worksiteReference["Team Member"]
@@ -155,6 +184,23 @@ def load_data(model, excel, verbose):
     model.vacancy_detail = VACANCY_DETAIL
 
 
+def add_constraint_block(model: Model, cts=None, names=None, indicators=None, equivalences=None):
+    """Emit collected constraints in bulk through the docplex batch APIs.
+
+    docplex argument checking is switched off for the batch when the model
+    was built with check_args=False.
+    """
+    if not model.check_args:
+        model.set_checker("off")
+    if cts:
+        model.add_constraints(cts, names)
+    if indicators:
+        model.add_indicator_constraints(indicators)
+    if equivalences:
+        model.add_equivalence_constraints(equivalences)
+    model.set_checker("default")
+
+
 def check_satisfied(timeAvai: TMemberAvailability, objt: TVacancyObjectTime):
     check_time = timeAvai.TimeFrom <= objt.DateFrom and objt.DateTo <= timeAvai.TimeTo
     return check_time
@@ -166,6 +212,73 @@ def setup_data(model: Model):
     lst.sort(key=lambda x: x.DateFrom)
     model.objecttime_ids = {i: o for i, o in enumerate(lst[0:7])}
 
+    # Availability index: (ContactID, day) -> first availability of that member
+    # on that day
+    model.availability_index = {}
+    for avail in model.availabilities:
+        model.availability_index.setdefault(
+            (avail.ContactID, getDate((avail.TimeFrom + avail.TimeTo) / 2)), avail)
+
+    # Feasible (member, objecttime) pairs: a member can only get a shift on a
+    # day they have an availability for, so no variables are created for the rest
+    model.shift_keys = [
+        (ctactId, objtId)
+        for ctactId in model.members.keys()
+        for objtId, objt in model.objecttime_ids.items()
+        if (ctactId, getDate((objt.DateFrom + objt.DateTo) / 2)) in model.availability_index
+    ]
+    model.member_objecttimes = {ctactId: [] for ctactId in model.members.keys()}
+    model.objecttime_members = {objtId: [] for objtId in model.objecttime_ids.keys()}
+    for ctactId, objtId in model.shift_keys:
+        model.member_objecttimes[ctactId].append(objtId)
+        model.objecttime_members[objtId].append(ctactId)
+
+
+def get_people_working_limits(model: Model):
+    "MinPeopleWorking and the most members on shift per object time, as used by the constraints"
+    minPeopleWorking = model.shift_constraints.MinPeopleWorking
+    vacancyQuantiyRequirement = model.vacancy_detail.Quantity
+    vacancyQuantiyRequirement = 12
+    minPeopleWorking = 7
+    return minPeopleWorking, vacancyQuantiyRequirement
+
+
+def capacity_check(model: Model):
+    """Most members that can be working at every moment, before anything is built.
+
+    A member can only work at a moment inside both the object time and their
+    availability, and only if that overlap fits a MIN_SHIFT_LENGTH shift.
+    Moments where this (capped by the max members per object time) is below
+    MinPeopleWorking make the model infeasible. Returns one row per moment.
+    """
+    minPeopleWorking, vacancyQuantiyRequirement = get_people_working_limits(model)
+    frames = []
+    for objtId, objt in model.objecttime_ids.items():
+        moments = np.arange(int(objt.DateFrom), int(objt.DateTo) + 1, PERIOD_MINUTE)
+        avails = [model.availability_index[(ctactId, getDate((objt.DateFrom + objt.DateTo) / 2))]
+                  for ctactId in model.objecttime_members[objtId]]
+        time_from = np.array([max(a.TimeFrom, objt.DateFrom) for a in avails], dtype=float)
+        time_to = np.array([min(a.TimeTo, objt.DateTo) for a in avails], dtype=float)
+        usable = time_to - time_from >= MIN_SHIFT_LENGTH
+        capacity = ((time_from[usable, None] <= moments) &
+                    (moments <= time_to[usable, None])).sum(axis=0)
+        capacity = np.minimum(capacity, vacancyQuantiyRequirement)
+        frames.append(pd.DataFrame({
+            "ObjectTimeID": objtId,
+            "Moment": moments,
+            "Capacity": capacity,
+            "MinPeopleWorking": minPeopleWorking,
+            "Shortfall": np.maximum(minPeopleWorking - capacity, 0),
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    short = df[df.Shortfall > 0]
+    print("Capacity check: {0} of {1} moments cannot reach MinPeopleWorking".format(
+        len(short), len(df)))
+    for row in short.itertuples():
+        print("  object time {0} at {1}: at most {2} of {3} members".format(
+            row.ObjectTimeID, model.num2date(row.Moment), row.Capacity, row.MinPeopleWorking))
+    return df
+
 
 def setup_variables(model: Model):
 
@@ -176,9 +289,9 @@ def setup_variables(model: Model):
     )
 
     # if a shift is assigned -> 1
-    model.shift_assignment_vars = model.binary_var_matrix(
-        keys1=model.members.keys(),
-        keys2=model.objecttime_ids.keys(),
+    print("Num of feasible shifts: ", len(model.shift_keys))
+    model.shift_assignment_vars = model.binary_var_dict(
+        keys=model.shift_keys,
         name="ShiftAssignment"
     )
 
@@ -186,28 +299,29 @@ def setup_variables(model: Model):
     model.shift_start_vars = {}
     model.shift_end_vars = {}
     model.break_start_vars = {}
-    for ctactId in model.members.keys():
-        for objtId, objtTime in model.objecttime_ids.items():
-            ""
-            key = (ctactId, objtId)
-            newShiftStart_var = model.integer_var(
-                lb=objtTime.DateFrom, ub=objtTime.DateTo, name="ShiftStart_{0}_{1}".format(*key))
-            newShiftEnd_var = model.integer_var(
-                lb=objtTime.DateFrom, ub=objtTime.DateTo, name="ShiftEnd_{0}_{1}".format(*key))
-            model.shift_start_vars[key] = newShiftStart_var
-            model.shift_end_vars[key] = newShiftEnd_var
-            for brk in range(MAX_BREAK_PER_SHIFT):
-                brkKey = (ctactId, objtId, brk)
-                newBreakStart_var = model.integer_var(
-                    lb=objtTime.DateFrom, ub=objtTime.DateTo, name="BreakStart_{0}_{1}_{2}".format(*brkKey))
-                model.break_start_vars[brkKey] = newBreakStart_var
+    for key in model.shift_keys:
+        ctactId, objtId = key
+        objtTime = model.objecttime_ids[objtId]
+        newShiftStart_var = model.integer_var(
+            lb=objtTime.DateFrom, ub=objtTime.DateTo, name="ShiftStart_{0}_{1}".format(*key))
+        newShiftEnd_var = model.integer_var(
+            lb=objtTime.DateFrom, ub=objtTime.DateTo, name="ShiftEnd_{0}_{1}".format(*key))
+        model.shift_start_vars[key] = newShiftStart_var
+        model.shift_end_vars[key] = newShiftEnd_var
+        for brk in range(MAX_BREAK_PER_SHIFT):
+            brkKey = (ctactId, objtId, brk)
+            newBreakStart_var = model.integer_var(
+                lb=objtTime.DateFrom, ub=objtTime.DateTo, name="BreakStart_{0}_{1}_{2}".format(*brkKey))
+            model.break_start_vars[brkKey] = newBreakStart_var
 
     # BreakDuration
     # print(model.break_start_vars)
-    model.break_allocated_vars = model.binary_var_cube(
-        keys1=model.members.keys(),
-        keys2=model.objecttime_ids.keys(),
-        keys3=[j for j in range(0, MAX_BREAK_PER_SHIFT)],
+    model.break_allocated_vars = model.binary_var_dict(
+        keys=[
+            (ctactId, objtId, j)
+            for ctactId, objtId in model.shift_keys
+            for j in range(0, MAX_BREAK_PER_SHIFT)
+        ],
         name="BreakDuration",
     )
 
@@ -222,28 +336,30 @@ def setup_variables(model: Model):
 
 
 def setup_constraints(model: Model):
-    def getDate(x): return int(x / (24 * 60))
-    minPeopleWorking = model.shift_constraints.MinPeopleWorking
-    vacancyQuantiyRequirement = model.vacancy_detail.Quantity
-    vacancyQuantiyRequirement = 12
-    minPeopleWorking = 7
-    SHIFT_DURATION_LIST = list(
-        # int(t*60) for t in ([0, 4] + [4+i/float(60/PERIOD_MINUTE) for i in range(1, int(6*float(60/PERIOD_MINUTE))+1)])
-        int(t*60) for t in ([0, 4, 6, 8, 11])
-    )
+    # constraints are collected per kind and emitted in bulk at the end
+    cts, ct_names, inds, eqs = [], [], [], []
+
+    def add_ct(ct, name=None):
+        cts.append(ct)
+        ct_names.append(name)
+
+    minPeopleWorking, vacancyQuantiyRequirement = get_people_working_limits(model)
     # print(model.num2date(model.objecttime_ids[0].DateFrom))
     # If any partial shift of a member is assigned => this member is assigned
     for ctactId, assignmendVar in model.member_assignment_vars.items():
         lstShift = [
             model.shift_assignment_vars[(ctactId, objecttimeId)]
-            for objecttimeId in model.objecttime_ids.keys()
+            for objecttimeId in model.member_objecttimes[ctactId]
         ]
+        if len(lstShift) == 0:
+            add_ct(assignmendVar == 0)
+            continue
         # if assigned
-        model.add_constraint(
+        eqs.append(
             model.equivalence_constraint(
-                assignmendVar, model.sum(lstShift) >= 1, true_value=1
-            ),
-            "ShiftAssignedToMemberAssigned",
+                assignmendVar, model.sum(lstShift) >= 1, true_value=1,
+                name="ShiftAssignedToMemberAssigned",
+            )
         )
 
     # ## CONSTRAINT: LIMIT THE NUMBER OF CONSECUTIVE day-SHIFT
@@ -304,36 +420,38 @@ def setup_constraints(model: Model):
         listVar2 = []
         for shift_duration in SHIFT_DURATION_LIST:
             newVar = model.binary_var()
-            model.add_equivalence(
+            eqs.append(model.equivalence_constraint(
                 newVar,
                 shiftEndtVar - shiftStartVar
                 == shift_duration
-            )
+            ))
             listVar2.append(newVar)
 
-        model.add_indicator(
+        inds.append(model.indicator_constraint(
             model.shift_assignment_vars[varKey],
             model.sums(*listVar2) == 1
-        )
+        ))
 
     # CONSTRAINT : LIMIT WORKING HOUR PER WEEEK
     # currently, considering the whole vacancy is a week
     model.work_time_vars = {}
     for ctactId in model.members.keys():
+        if len(model.member_objecttimes[ctactId]) == 0:
+            continue
         # model.work_time_vars[ctactId] =
-        model.add_constraint(
+        add_ct(
             model.le_constraint(
                 model.sum(
                     (
                         model.shift_end_vars[(ctactId, objtId)]
                         - model.shift_start_vars[(ctactId, objtId)]
                     )
-                    for objtId in model.objecttime_ids.keys()
+                    for objtId in model.member_objecttimes[ctactId]
                 )
                 - model.sum(
                     model.break_allocated_vars[
                         (ctactId, objtId, brk)] * DEFAULT_BREAK_LENGTH
-                    for objtId in model.objecttime_ids.keys()
+                    for objtId in model.member_objecttimes[ctactId]
                     for brk in range(0, MAX_BREAK_PER_SHIFT)
                 ),
                 model.shift_constraints.MaxHoursPerWeek * 60,  # Minutes
@@ -350,33 +468,33 @@ def setup_constraints(model: Model):
         shiftEnd_var = model.shift_end_vars[varKey]
 
         # Set range for shift_start according to objectTime
-        model.add_indicator(
+        inds.append(model.indicator_constraint(
             shiftAssignment_var,
             shiftStart_var >= objt.DateFrom,
             name="Shift.Start>=Date.From",
-        )
+        ))
 
         # Set range for shift_end according to objectTime
-        model.add_indicator(
+        inds.append(model.indicator_constraint(
             shiftAssignment_var,
             shiftEnd_var <= objt.DateTo,
             name="Shift.End<=Date.To",
-        )
+        ))
 
         # if shift is not assigned
-        model.add_equivalence(
+        eqs.append(model.equivalence_constraint(
             shiftAssignment_var,
             shiftStart_var == shiftEnd_var,
             true_value=0,
             name="ShiftAssignment",
-        )
+        ))
         # else
-        model.add_equivalence(
+        eqs.append(model.equivalence_constraint(
             shiftAssignment_var,
             shiftEnd_var - shiftStart_var >= MIN_SHIFT_LENGTH,
             true_value=1,
             name="ShiftAssignment",
-        )
+        ))
 
         for brk in range(0, MAX_BREAK_PER_SHIFT):
             brk_key = (ctactId, objtId, brk)
@@ -389,50 +507,50 @@ def setup_constraints(model: Model):
                 # print(model.num2date(moment))
                 newVar = model.binary_var(
                     "K({0}_{1}_{2}_{3})".format(ctactId, objtId, brk, moment))
-                model.add_equivalence(
+                eqs.append(model.equivalence_constraint(
                     newVar,
                     model.break_start_vars[brk_key] == moment
-                )
+                ))
                 k.append(newVar)
 
-            model.add_indicator(
+            inds.append(model.indicator_constraint(
                 model.break_allocated_vars[brk_key],
                 model.sums(*k) == 1
-            )
+            ))
 
-            model.add_indicator(
+            inds.append(model.indicator_constraint(
                 model.break_allocated_vars[brk_key],
                 model.break_start_vars[brk_key] >= shiftStart_var,
                 name="Break.Start>=Shift.Start",
-            )
-            model.add_indicator(
+            ))
+            inds.append(model.indicator_constraint(
                 model.break_allocated_vars[brk_key],
                 model.break_start_vars[brk_key] +
                 model.break_allocated_vars[brk_key] * DEFAULT_BREAK_LENGTH
                 <= shiftEnd_var,
                 name="Break.Start+Duration<=Shift.End",
-            )
+            ))
 
             if brk == 0:
-                model.add_equivalence(
+                eqs.append(model.equivalence_constraint(
                     model.break_allocated_vars[brk_key],
                     shiftEnd_var - shiftStart_var
                     >= model.shift_constraints.ScheduledBreakHours.From + 1,
-                )
+                ))
 
-                model.add_indicator(
+                inds.append(model.indicator_constraint(
                     model.break_allocated_vars[brk_key],
                     model.break_start_vars[brk_key]
                     >= shiftStart_var
                     + model.shift_constraints.ScheduledBreakHours.From,
-                )
+                ))
 
-                model.add_indicator(
+                inds.append(model.indicator_constraint(
                     model.break_allocated_vars[brk_key],
                     model.break_start_vars[brk_key] +
                     model.break_allocated_vars[brk_key] * DEFAULT_BREAK_LENGTH
                     <= shiftStart_var + model.shift_constraints.ScheduledBreakHours.To,
-                )
+                ))
             else:
                 model.add_if_then(
                     shiftEnd_var - shiftStart_var
@@ -440,12 +558,12 @@ def setup_constraints(model: Model):
                     model.break_allocated_vars[brk_key] == 0
                 )
 
-                model.add_indicator(
+                inds.append(model.indicator_constraint(
                     model.break_allocated_vars[brk_key],
                     model.break_start_vars[brk_key]
                     >= shiftStart_var
                     + SECONDARY_BREAK_TIME,
-                )
+                ))
 
     # Check Availability
     heuristic_check_num = {key: 0 for key in model.objecttime_ids.keys()}
@@ -457,11 +575,8 @@ def setup_constraints(model: Model):
         shiftStart_var = model.shift_start_vars[varKey]
         shiftEnd_var = model.shift_end_vars[varKey]
 
-        timeAvai = lookup(
-            model.availabilities,
-            lambda avail: (ctactId == avail.ContactID)
-            and getDate((avail.TimeFrom + avail.TimeTo) / 2)
-            == getDate((objt.DateFrom + objt.DateTo) / 2),
+        timeAvai = model.availability_index.get(
+            (ctactId, getDate((objt.DateFrom + objt.DateTo) / 2))
         )
 
         # print(shiftStart_var,timeAvai)
@@ -478,25 +593,25 @@ def setup_constraints(model: Model):
             listVar1 = []
             for start_time in get_starttime_var_list:
                 newVar = model.binary_var()
-                model.add_equivalence(
+                eqs.append(model.equivalence_constraint(
                     newVar, shiftStart_var == start_time
-                )
+                ))
                 listVar1.append(newVar)
             if len(listVar1) > 0:
-                model.add_indicator(
+                inds.append(model.indicator_constraint(
                     shiftAssignment_var,
                     model.sums(*listVar1) == 1
-                )
+                ))
             else:
-                model.add_constraint(shiftAssignment_var == 0)
+                add_ct(shiftAssignment_var == 0)
 
             del listVar1
 
             if check_satisfied(timeAvai, objt) and heuristic_check_num[objtId] < vacancyQuantiyRequirement:
                 # print("+", ctactId, objtId)
                 heuristic_check_num[objtId] += 1
-                model.add_constraint(shiftAssignment_var == 1)
-                model.add_constraint(
+                add_ct(shiftAssignment_var == 1)
+                add_ct(
                     shiftEnd_var - shiftStart_var
                     >= 6*60
                 )
@@ -511,11 +626,11 @@ def setup_constraints(model: Model):
                     #     name="Shift.Start==Day.Start",
                     # )
                 else:
-                    model.add_indicator(
+                    inds.append(model.indicator_constraint(
                         shiftAssignment_var,
                         shiftStart_var >= timeAvai.TimeFrom,
                         name="Shift.Start>=Availability.Start",
-                    )
+                    ))
 
                 # Set range for shift_end according to member Availability
                 if timeAvai.TimeTo >= objt.DateTo:
@@ -526,16 +641,16 @@ def setup_constraints(model: Model):
                     #     name="Shift.End==Day.End",
                     # )
                 else:
-                    model.add_indicator(
+                    inds.append(model.indicator_constraint(
                         shiftAssignment_var,
                         shiftEnd_var <= timeAvai.TimeTo,
                         name="Shift.End<=Availability.End",
-                    )
+                    ))
 
         else:
             # print("-", ctactId, objtId)
             "If a shift_var of a member who is not availabe -> Start == Exnd"
-            model.add_constraint(shiftAssignment_var == 0)
+            add_ct(shiftAssignment_var == 0)
 
     # print(">> Heuristic check num", heuristic_check_num)
 
@@ -548,7 +663,7 @@ def setup_constraints(model: Model):
             # this var_list is to check if each member is working or not at this moment
             check_mem_isworking_vars = []
             check_object_times_vars = []
-            for contactId in model.members.keys():
+            for contactId in model.objecttime_members[objtId]:
                 shift_checker = []
                 is_working_var = model.binary_var(
                     "working_{0}_{1}".format(moment, contactId)
@@ -567,17 +682,17 @@ def setup_constraints(model: Model):
                 check_shift = model.binary_var()
 
                 # moment must be insite shift-range
-                model.add_equivalence(
+                eqs.append(model.equivalence_constraint(
                     checkStart_var, start <= moment
-                )
+                ))
 
-                model.add_equivalence(
+                eqs.append(model.equivalence_constraint(
                     checkEnd_var,
                     (moment == end) if moment == objt.DateTo else (
                         moment <= end - 1)
-                )
+                ))
 
-                model.add_constraint(
+                add_ct(
                     check_shift
                     == model.logical_and(
                         checkEnd_var, checkStart_var
@@ -596,13 +711,13 @@ def setup_constraints(model: Model):
                     _checkEnd_var = model.binary_var()
 
                     # moment must be outsite break-range
-                    model.add_equivalence(
-                        _checkStart_var, moment <= _brk_start - 1)
+                    eqs.append(model.equivalence_constraint(
+                        _checkStart_var, moment <= _brk_start - 1))
 
-                    model.add_equivalence(
+                    eqs.append(model.equivalence_constraint(
                         _checkEnd_var, moment >= (_brk_start + _duration)
-                    )
-                    model.add_constraint(
+                    ))
+                    add_ct(
                         _check_break
                         == model.logical_or(
                             _checkStart_var, _checkEnd_var
@@ -620,24 +735,24 @@ def setup_constraints(model: Model):
                 arr.append(model.shift_assignment_vars[key])
 
                 # if all is ok => this member is working at this moment
-                model.add_constraint(
+                add_ct(
                     is_working_var == model.logical_and(*arr)
                 )
                 check_mem_isworking_vars.append(is_working_var)
 
-                model.add_constraint(
+                add_ct(
                     is_shift_var == model.logical_or(*shift_checker)
                 )
                 check_object_times_vars.append(is_shift_var)
 
             # print(model.sum(mem_isworking_vars),"ct_{0}_{1}".format(objtId,moment))
             # SUM(mem_isworking_vars) >= MinPeopleWorking
-            model.add_constraint(
+            add_ct(
                 model.sum(check_mem_isworking_vars) >= minPeopleWorking,
                 "MinPeopleWorking_{0}_{1}".format(objtId, moment),
             )
 
-            model.add_constraint(
+            add_ct(
                 model.sum(check_object_times_vars) <= vacancyQuantiyRequirement,
                 "MaxObjectTime_{0}_{1}".format(objtId, moment),
             )
@@ -669,6 +784,177 @@ def setup_constraints(model: Model):
     #     for key in model.shift_assignment_vars.keys()
     # )
 
+    add_constraint_block(model, cts, ct_names, inds, eqs)
+    return
+
+
+def get_break_patterns(model: Model, objt: TVacancyObjectTime, start, end):
+    "All legal break placements (tuples of break starts) for a shift [start, end)"
+    moments = range(int(objt.DateFrom), int(objt.DateTo) -
+                    DEFAULT_BREAK_LENGTH + 1, PERIOD_MINUTE)
+    breakHours = model.shift_constraints.ScheduledBreakHours
+
+    if end - start < breakHours.From + 1:
+        first_breaks = [None]
+    else:
+        first_breaks = [
+            moment for moment in moments
+            if moment >= start + breakHours.From
+            and moment + DEFAULT_BREAK_LENGTH <= min(start + breakHours.To, end)
+        ]
+    # the second break is optional once the shift reaches SECONDARY_BREAK_TIME
+    second_breaks = [None]
+    if end - start >= SECONDARY_BREAK_TIME:
+        second_breaks += [
+            moment for moment in moments
+            if moment >= start + SECONDARY_BREAK_TIME
+            and moment + DEFAULT_BREAK_LENGTH <= end
+        ]
+
+    return [
+        tuple(brk for brk in (brk1, brk2) if brk is not None)
+        for brk1 in first_breaks
+        for brk2 in second_breaks
+    ]
+
+
+def get_shift_coverage(objt: TVacancyObjectTime, start, end, breaks):
+    "0/1 vectors over the objecttime moments: working (outside breaks) and on shift"
+    moments = np.arange(int(objt.DateFrom), int(objt.DateTo) + 1, PERIOD_MINUTE)
+    on_shift = (start <= moments) & (
+        (moments <= end - 1) | ((moments == end) & (moments == objt.DateTo)))
+    working = on_shift.copy()
+    for brk in breaks:
+        working &= ~((brk <= moments) & (moments < brk + DEFAULT_BREAK_LENGTH))
+    return working.astype(int), on_shift.astype(int)
+
+
+def setup_candidate_shifts(model: Model):
+    "Enumerate every candidate shift (start time x duration x break pattern) of the feasible pairs"
+    model.candidate_shifts = []
+    for ctactId, objtId in model.shift_keys:
+        objt = model.objecttime_ids[objtId]
+        timeAvai = model.availability_index[(
+            ctactId, getDate((objt.DateFrom + objt.DateTo) / 2))]
+        latest_end = min(objt.DateTo, timeAvai.TimeTo)
+        for start_time in [(getDate(objt.DateFrom) * 24 * 60 + i) for i in START_TIMES_LIST]:
+            if start_time < objt.DateFrom or start_time < timeAvai.TimeFrom:
+                continue
+            for shift_duration in SHIFT_DURATION_LIST:
+                end_time = start_time + shift_duration
+                if shift_duration < MIN_SHIFT_LENGTH or end_time > latest_end:
+                    continue
+                for breaks in get_break_patterns(model, objt, start_time, end_time):
+                    working, on_shift = get_shift_coverage(
+                        objt, start_time, end_time, breaks)
+                    model.candidate_shifts.append(TCandidateShift(
+                        ctactId, objtId, start_time, end_time, breaks, working, on_shift))
+
+    print("Num of candidate shifts: ", len(model.candidate_shifts))
+    model.candidate_vars = model.binary_var_list(
+        len(model.candidate_shifts), name="CandidateShift")
+
+
+def setup_pattern_constraints(model: Model):
+    "Constraints of the 'pattern' formulation: coverage is a linear sum per moment"
+    cts, ct_names, inds, eqs = [], [], [], []
+
+    def add_ct(ct, name=None):
+        cts.append(ct)
+        ct_names.append(name)
+
+    minPeopleWorking, vacancyQuantiyRequirement = get_people_working_limits(model)
+
+    candidates_of_key = {key: [] for key in model.shift_keys}
+    for cand, var in zip(model.candidate_shifts, model.candidate_vars):
+        candidates_of_key[(cand.ContactID, cand.ObjectTimeID)].append((cand, var))
+
+    # If any partial shift of a member is assigned => this member is assigned
+    for ctactId, assignmendVar in model.member_assignment_vars.items():
+        lstShift = [
+            model.shift_assignment_vars[(ctactId, objecttimeId)]
+            for objecttimeId in model.member_objecttimes[ctactId]
+        ]
+        if len(lstShift) == 0:
+            add_ct(assignmendVar == 0)
+            continue
+        eqs.append(
+            model.equivalence_constraint(
+                assignmendVar, model.sum(lstShift) >= 1, true_value=1,
+                name="ShiftAssignedToMemberAssigned",
+            )
+        )
+
+    # At most one candidate per (member, objecttime); the shift/break variables
+    # are linked linearly so displayModel reads them like in the moment formulation
+    for key, candidates in candidates_of_key.items():
+        ctactId, objtId = key
+        objt = model.objecttime_ids[objtId]
+        add_ct(
+            model.shift_assignment_vars[key]
+            == model.sum(var for _, var in candidates),
+            "ShiftAssignment",
+        )
+        add_ct(
+            model.shift_start_vars[key] == objt.DateFrom
+            + model.sum(var * (cand.Start - objt.DateFrom) for cand, var in candidates))
+        add_ct(
+            model.shift_end_vars[key] == objt.DateFrom
+            + model.sum(var * (cand.End - objt.DateFrom) for cand, var in candidates))
+        for brk in range(0, MAX_BREAK_PER_SHIFT):
+            brk_key = (ctactId, objtId, brk)
+            with_break = [(cand, var)
+                          for cand, var in candidates if len(cand.Breaks) > brk]
+            add_ct(
+                model.break_allocated_vars[brk_key]
+                == model.sum(var for _, var in with_break))
+            add_ct(
+                model.break_start_vars[brk_key] == objt.DateFrom
+                + model.sum(var * (cand.Breaks[brk] - objt.DateFrom) for cand, var in with_break))
+
+    # CONSTRAINT : LIMIT WORKING HOUR PER WEEEK
+    for ctactId in model.members.keys():
+        if len(model.member_objecttimes[ctactId]) == 0:
+            continue
+        add_ct(
+            model.sum(
+                var * (cand.End - cand.Start -
+                       len(cand.Breaks) * DEFAULT_BREAK_LENGTH)
+                for objtId in model.member_objecttimes[ctactId]
+                for cand, var in candidates_of_key[(ctactId, objtId)]
+            )
+            <= model.shift_constraints.MaxHoursPerWeek * 60,  # Minutes
+            "MaxHoursPerWeek",
+        )
+
+    # CONSTRAINT: MAKE SURE THERE ARE ALWAYS 'Minimum People Working' AT ANY MOMENT
+    for objtId, objt in tqdm(model.objecttime_ids.items()):
+        candidates = [
+            (cand, var)
+            for contactId in model.objecttime_members[objtId]
+            for cand, var in candidates_of_key[(contactId, objtId)]
+        ]
+        if len(candidates) == 0:
+            continue
+        working = np.array([cand.Working for cand, _ in candidates])
+        on_shift = np.array([cand.OnShift for cand, _ in candidates])
+        for i, moment in enumerate(range(
+            int(objt.DateFrom), int(objt.DateTo) + 1, PERIOD_MINUTE
+        )):  # include objt.DateTo
+            add_ct(
+                model.sum(candidates[j][1]
+                          for j in np.flatnonzero(working[:, i]))
+                >= minPeopleWorking,
+                "MinPeopleWorking_{0}_{1}".format(objtId, moment),
+            )
+            add_ct(
+                model.sum(candidates[j][1]
+                          for j in np.flatnonzero(on_shift[:, i]))
+                <= vacancyQuantiyRequirement,
+                "MaxObjectTime_{0}_{1}".format(objtId, moment),
+            )
+
+    add_constraint_block(model, cts, ct_names, inds, eqs)
     return
 
 
@@ -712,10 +998,38 @@ def print_solution(model: Model):
     print("*************************** Solution ***************************")
 
 
-def solve(model: Model, **kwargs):
-    # Here, we set the number of threads for CPLEX to 2 and set the time limit to 2mins.
-    model.parameters.threads = 14
-    model.parameters.timelimit = 7200  # solver should not take more than that !
+def add_warm_start(model: Model, source):
+    """Pass a prior solution to CPLEX as a MIP start.
+
+    source is the solution.json exported by a previous run, or a dict of
+    variable name -> value. Variables are matched by name (ShiftAssignment,
+    ShiftStart/ShiftEnd, BreakStart, BreakDuration, ...); names that no longer
+    exist are skipped, and CPLEX repairs the start if the input has changed.
+    """
+    if isinstance(source, dict):
+        values = source
+    else:
+        with open(source, "r") as fp:
+            values = {v["name"]: float(v["value"])
+                      for v in json.load(fp)["CPLEXSolution"]["variables"]}
+    start = {}
+    for name, value in values.items():
+        var = model.get_var_by_name(name)
+        if var is not None:
+            start[var] = value
+    print("Warm start: {0} of {1} variables matched".format(len(start), len(values)))
+    if start:
+        model.add_mip_start(model.new_solution(start),
+                            effort_level=EffortLevel.Repair,
+                            write_level=WriteLevel.AllVars)
+
+
+def solve(model: Model, warm_start=None, threads=14, timelimit=7200, **kwargs):
+    # Here, we set the number of threads for CPLEX and the time limit (in seconds).
+    model.parameters.threads = threads
+    model.parameters.timelimit = timelimit  # solver should not take more than that !
+    if warm_start is not None:
+        add_warm_start(model, warm_start)
     sol = model.solve(log_output=True, **kwargs)
     if sol is not None:
         print("solution for a cost of {}".format(model.objective_value))
@@ -727,16 +1041,29 @@ def solve(model: Model, **kwargs):
         return None
 
 
-def build(context=None, verbose=False, **kwargs):
+def build(context=None, verbose=False, formulation=FORMULATION, check_args=True, precheck=True, **kwargs):
     mdl = Model("Members", context=context, **kwargs)
+    mdl.formulation = formulation
+    mdl.check_args = check_args
     print("Loading data")
-    load_data(mdl, excel_data_file, verbose=verbose)
+    load_data(mdl, read_sheets(), verbose=verbose)
     print("Setting up data")
     setup_data(mdl)
+    if precheck:
+        # the model cannot be feasible, don't build it
+        mdl.capacity = capacity_check(mdl)
+        if mdl.capacity.Shortfall.sum() > 0:
+            print("* model is infeasible")
+            return None
     print("Setting up variable")
     setup_variables(mdl)
+    if formulation == "pattern":
+        setup_candidate_shifts(mdl)
     print("Setting up constraint")
-    setup_constraints(mdl)
+    if formulation == "pattern":
+        setup_pattern_constraints(mdl)
+    else:
+        setup_constraints(mdl)
     print("Setting up objectives")
     setup_objective(mdl)
     return mdl
@@ -793,19 +1120,20 @@ def displayModel(model: Model):
         if model.solution.get_value(var.name) > 0
     ]
 
-    df_break["__Num1"] = [
-        sum(
-            model.solution.get_value("K({0}_{1}_{2}_{3})".format(
-                key[0], key[1], key[2], moment))
-            for moment in range(
-                model.objecttime_ids[key[1]].DateFrom,
-                model.objecttime_ids[key[1]].DateTo - DEFAULT_BREAK_LENGTH + 1,
-                PERIOD_MINUTE
+    if model.formulation == "moment":
+        df_break["__Num1"] = [
+            sum(
+                model.solution.get_value("K({0}_{1}_{2}_{3})".format(
+                    key[0], key[1], key[2], moment))
+                for moment in range(
+                    model.objecttime_ids[key[1]].DateFrom,
+                    model.objecttime_ids[key[1]].DateTo - DEFAULT_BREAK_LENGTH + 1,
+                    PERIOD_MINUTE
+                )
             )
-        )
-        for key, var in model.break_allocated_vars.items()
-        if model.solution.get_value(var.name) > 0
-    ]
+            for key, var in model.break_allocated_vars.items()
+            if model.solution.get_value(var.name) > 0
+        ]
 
     df_shift["ObjectTimeStart"] = [
         model.num2date(model.objecttime_ids[key[1]].DateFrom)
@@ -817,6 +1145,20 @@ def displayModel(model: Model):
         for key, var in model.shift_assignment_vars.items()
         if model.solution.get_value(var.name) == 1
     ]
+    def availability_get(key):
+        objt = model.objecttime_ids[key[1]]
+        return model.availability_index[(key[0], getDate((objt.DateFrom + objt.DateTo) / 2))]
+
+    df_shift["AvailableFrom"] = [
+        model.num2date(availability_get(key).TimeFrom)
+        for key, var in model.shift_assignment_vars.items()
+        if model.solution.get_value(var.name) == 1
+    ]
+    df_shift["AvailableTo"] = [
+        model.num2date(availability_get(key).TimeTo)
+        for key, var in model.shift_assignment_vars.items()
+        if model.solution.get_value(var.name) == 1
+    ]
     df_shift["StartShift"] = [
         model.num2date(model.solution.get_value(
             model.shift_start_vars[key].name))
@@ -852,7 +1194,7 @@ def displayModel(model: Model):
         # check for every moment with offset = 30min
         for moment in range(int(objt.DateFrom), int(objt.DateTo) + 1, PERIOD_MINUTE):
             lst = []
-            for contactId in model.members.keys():
+            for contactId in model.objecttime_members[objtId]:
                 if model.solution.get_value(
                     model.shift_assignment_vars[(
                         contactId, objtId)].name
@@ -920,6 +1262,8 @@ def displayModel(model: Model):
 if __name__ == "__main__":
     # Build model
     model = build()
+    if model is None:
+        sys.exit(1)
 
     # Solve the model and print solution
     solve(model)
@@ -17,7 +17,9 @@ import datetime
 from tqdm import tqdm
 import pandas as pd
 from docplex.mp.model import Model
+from docplex.mp.constants import EffortLevel, WriteLevel
 from docplex.util.environment import get_environment
+from docplex.mp.progress import SolutionListener
 from functools import reduce
 import numpy as np
 import uuid
@@ -26,7 +28,226 @@ from datetime import timedelta
 import sys
 import time
 import json
+import os
+import random
+import hashlib
+import re
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import queue
+import tempfile
+import cplex
+from cplex.callbacks import MIPInfoCallback
 from pandas import json_normalize
+from input_snapshot import InputSnapshot
+try:
+    from ortools.sat.python import cp_model
+except ImportError:
+    cp_model = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# StartDateTime / EndDateTime of the input json
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Frames on the model built by load_input_data from the input json
+INPUT_TABLES = ['df_vacancy_details', 'vacancy_objecttime', 'df_teamMember_availability',
+                'teamMember_qual', 'df_shift_constraints', 'df_worksite_reference', 'tm_shift_pref']
+# GUID columns of the input json, coded to ints by GuidTable
+GUID_COLUMNS = ['ContactID', 'VacancyID', 'ObjectTimeID', 'WorksiteID', 'MeasurementID']
+
+
+class GuidTable:
+    """Dense int32 ids for the GUIDs of the input, shared by all GUID columns.
+
+    The model objects hold the ids; CreateResults translates them back.
+    Missing values (None) are coded -1 and decode to None.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.guids = []
+
+    def __getitem__(self, id):
+        return self.guids[id] if id >= 0 else None
+
+    def get(self, guid):
+        "Id of guid, or None if it is not in the input"
+        return self.ids.get(guid)
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        lookup = np.empty(len(uniques) + 1, dtype=np.int32)
+        lookup[-1] = -1
+        for n, guid in enumerate(uniques):
+            if guid not in self.ids:
+                self.ids[guid] = len(self.guids)
+                self.guids.append(guid)
+            lookup[n] = self.ids[guid]
+        return lookup[codes]
+
+    def decode(self, ids):
+        guids = np.array(self.guids + [None], dtype=object)
+        return guids[np.asarray(ids, dtype=np.int64)]
+
+
+class JsonSectionReader:
+    """Incremental reader for a {section: [record, ...]} json file.
+
+    The file is read in chunk_size pieces and decoded one record at a time;
+    the fields of each record go straight into per-column lists, turned into
+    the section's DataFrame once the section ends. Peak memory is about one
+    section's columns instead of the raw text, the parsed json and the
+    json_normalize copy together. Nested objects are flattened to "a.b"
+    columns as json_normalize does.
+    """
+
+    WHITESPACE = re.compile(r"\s*")
+
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        "Append the next chunk to the buffer, dropping what was consumed; False at the end of the file"
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return len(chunk) > 0
+
+    def peek(self):
+        "Next non-whitespace character ('' at the end of the file)"
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == '' or char not in chars:
+            raise ValueError("{0}: expected {1!r} at {2!r}".format(
+                self.path, chars, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        "Decode the next json value, reading more of the file until it is complete"
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number may continue in the next chunk
+                if end < len(self.buffer) or not self.fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def flatten(self, record, prefix=""):
+        for field, value in record.items():
+            if isinstance(value, dict):
+                yield from self.flatten(value, prefix + field + ".")
+            else:
+                yield prefix + field, value
+
+    def records(self):
+        "DataFrame of the records of the array at the current position"
+        self.expect("[")
+        columns = {}
+        n = 0
+        if self.peek() == "]":
+            self.pos += 1
+            return pd.DataFrame()
+        # repeated strings (GUIDs, dates, names) are stored once
+        strings = {}
+        while True:
+            for field, value in self.flatten(self.value()):
+                if isinstance(value, str):
+                    value = strings.setdefault(value, value)
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = [None] * n
+                column.append(value)
+            n += 1
+            for column in columns.values():
+                if len(column) < n:
+                    column.append(None)
+            if self.expect(",]") == "]":
+                return pd.DataFrame(columns)
+
+    def sections(self):
+        "Yield (section, DataFrame) per top-level array of records, (section, value) for anything else"
+        with open(self.path, "r", encoding="utf-8") as file:
+            self.file = file
+            self.buffer, self.pos = "", 0
+            self.expect("{")
+            if self.peek() == "}":
+                return
+            while True:
+                section = self.value()
+                self.expect(":")
+                if self.peek() == "[":
+                    yield section, self.records()
+                else:
+                    yield section, self.value()
+                if self.expect(",}") == "}":
+                    return
+
+
+class ColumnStore:
+    """Struct of arrays holding the rows of a namedtuple type.
+
+    One NumPy array per field. Iterating, or indexing with an int, gives row
+    views: instances of the namedtuple built on demand with Python scalars,
+    so loops reading avail.start_hour keep working. Vectorised code reads the
+    columns as attributes (availabilities.start_hour). Indexing with a slice,
+    a boolean mask or an index array gives a ColumnStore.
+    """
+
+    def __init__(self, row_type, columns):
+        self.row_type = row_type
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, row_type, df):
+        "Fields taken from the columns of df in order, as row_type(*row) over iterrows"
+        return cls(row_type, {field: df.iloc[:, i].to_numpy()
+                              for i, field in enumerate(row_type._fields)})
+
+    @classmethod
+    def from_rows(cls, row_type, rows):
+        return cls.from_frame(row_type, pd.DataFrame(list(rows), columns=row_type._fields))
+
+    def __len__(self):
+        return len(self.columns[self.row_type._fields[0]])
+
+    def __getattr__(self, field):
+        try:
+            return self.__dict__['columns'][field]
+        except KeyError:
+            raise AttributeError(field)
+
+    def __iter__(self):
+        return map(self.row_type._make, zip(*(column.tolist() for column in self.columns.values())))
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.row_type._make(column[index:index + 1 or None].tolist()[0]
+                                       for column in self.columns.values())
+        return ColumnStore(self.row_type, {field: column[index]
+                                           for field, column in self.columns.items()})
+
+    def __add__(self, other):
+        if len(other) == 0:
+            return self
+        if not isinstance(other, ColumnStore):
+            other = ColumnStore.from_rows(self.row_type, other)
+        return ColumnStore(self.row_type, {field: np.concatenate([column, other.columns[field]])
+                                           for field, column in self.columns.items()})
 
 
 class ModelObjects:
@@ -43,6 +264,9 @@ class ModelObjects:
         self.model.TPeriod = namedtuple(
             "TPeriod",
             ["contactid", "shift", "period_start", "period_end", "work_indicator", "break1_indicator", "break2_indicator"])
+        self.model.TPattern = namedtuple(
+            "TPattern",
+            ["contactid", "shift", "breaks", "var"])
         self.model.TTeamMemberInfo = namedtuple(
             "TTeamMemberInfo",
             ["contactid", "gradeid", "ebaid", "employment_typeid", "availability", "roster"])
@@ -86,98 +310,121 @@ class ModelObjects:
             ['vacancyid', 'StartDateTime', 'EndDateTime', 'quantity', 'minquantity', 'worksiteid', 'posisitonid', 'measurementid'])
 
     def read_input_data(self):
-        file = open(self.json_input, "r")
-        contents = file. read()
-        file. close()
-        self.input_json = json.loads(contents)
+        "Stream the input json section by section into frames (see JsonSectionReader)"
+        self.input_json = dict(JsonSectionReader(self.json_input).sections())
+
+    def load_input(self):
+        "read_input_data and load_input_data, skipped when the InputSnapshot of the input json is current"
+        snapshot = None
+        if self.model.snapshot_dir is not None:
+            snapshot = InputSnapshot(self.json_input, self.model.snapshot_dir)
+            loaded = snapshot.load()
+            if loaded is not None:
+                tables, extras = loaded
+                for name in INPUT_TABLES:
+                    setattr(self.model, name, tables[name])
+                self.model.anchor_date = pd.Timestamp(extras["anchor_date"])
+                return
+        self.read_input_data()
+        self.load_input_data()
+        if snapshot is not None:
+            snapshot.save({name: getattr(self.model, name) for name in INPUT_TABLES},
+                          {"anchor_date": self.model.anchor_date.isoformat()})
 
     def load_input_data(self):
-        self.model.df_vacancy_details = json_normalize(
-            self.input_json['Vacancy_details'])
-        self.model.vacancy_objecttime = json_normalize(
-            self.input_json['Vacancy_ObjectTime'])
-        self.model.df_teamMember_availability = json_normalize(
-            self.input_json['Team_Member_Availability'])
-        self.model.teamMember_qual = json_normalize(
-            self.input_json['Team_Member_Qualifications'])
-        self.model.df_shift_constraints = json_normalize(
-            self.input_json['Shift_Constraints'])
-        self.model.df_worksite_reference = json_normalize(
-            self.input_json['Worksite_Preferences'])
-        self.model.tm_shift_pref = json_normalize(
-            self.input_json['Team_Member_Shift_Preference'])
-        self.model.anchor_date = pd.to_datetime(
-            self.model.df_vacancy_details.StartDateTime).min()
-        # convert to datetime
-        self.model.df_vacancy_details['StartDateTime'] = pd.to_datetime(
-            self.model.df_vacancy_details['StartDateTime'])
-        self.model.df_vacancy_details['EndDateTime'] = pd.to_datetime(
-            self.model.df_vacancy_details['EndDateTime'])
-        self.model.vacancy_objecttime['StartDateTime'] = pd.to_datetime(
-            self.model.vacancy_objecttime['StartDateTime'])
-        self.model.vacancy_objecttime['EndDateTime'] = pd.to_datetime(
-            self.model.vacancy_objecttime['EndDateTime'])
-        self.model.df_teamMember_availability['StartDateTime'] = pd.to_datetime(
-            self.model.df_teamMember_availability['StartDateTime'])
-        self.model.df_teamMember_availability['EndDateTime'] = pd.to_datetime(
-            self.model.df_teamMember_availability['EndDateTime'])
-        # convert to num
-        self.convert_time_to_num(
-            self.model.df_vacancy_details, 'StartDateTime')
-        self.convert_time_to_num(self.model.df_vacancy_details, 'EndDateTime')
-        self.convert_time_to_num(
-            self.model.df_teamMember_availability, 'StartDateTime')
-        self.convert_time_to_num(
-            self.model.df_teamMember_availability, 'EndDateTime')
-        self.convert_time_to_num(
-            self.model.vacancy_objecttime, 'StartDateTime')
-        self.convert_time_to_num(self.model.vacancy_objecttime, 'EndDateTime')
+        self.model.df_vacancy_details = self.input_json['Vacancy_details']
+        self.model.vacancy_objecttime = self.input_json['Vacancy_ObjectTime']
+        self.model.df_teamMember_availability = self.input_json['Team_Member_Availability']
+        self.model.teamMember_qual = self.input_json['Team_Member_Qualifications']
+        self.model.df_shift_constraints = self.input_json['Shift_Constraints']
+        self.model.df_worksite_reference = self.input_json['Worksite_Preferences']
+        self.model.tm_shift_pref = self.input_json['Team_Member_Shift_Preference']
+        # parse every StartDateTime/EndDateTime column once, then to hours
+        timed = [self.model.df_vacancy_details, self.model.vacancy_objecttime,
+                 self.model.df_teamMember_availability]
+        for df in timed:
+            for col in ['StartDateTime', 'EndDateTime']:
+                df[col] = pd.to_datetime(df[col], format=DATETIME_FORMAT)
+        self.model.anchor_date = self.model.df_vacancy_details.StartDateTime.min()
+        for df in timed:
+            for col in ['StartDateTime', 'EndDateTime']:
+                self.convert_time_to_num(df, col)
+        # an availability starting and ending at the same time is a whole day
+        avail = self.model.df_teamMember_availability
+        whole_day = avail.StartDateTime == avail.EndDateTime
+        avail.loc[whole_day, 'EndDateTime'] = avail.loc[whole_day, 'StartDateTime'] + 24
+
+    def intern_guids(self, df):
+        "Copy of df with the GUID columns coded by model.guids"
+        df = df.copy()
+        for col in GUID_COLUMNS:
+            if col in df:
+                df[col] = self.model.guids.encode(df[col])
+        return df
 
     def load_model_objects(self):
-        for i in range(len(self.model.df_teamMember_availability)):
-            if self.model.df_teamMember_availability.loc[i, 'StartDateTime'] == self.model.df_teamMember_availability.loc[i, 'EndDateTime']:
-                self.model.df_teamMember_availability.loc[i,
-                                                          'EndDateTime'] = self.model.df_teamMember_availability.loc[i, 'StartDateTime'] + 24
-
-        MEM_AVAILAVILITY = [
-            self.model.TMemberAvailability(*row) for _, row in self.model.df_teamMember_availability.iterrows()
-        ]
-        self.model.availabilities = MEM_AVAILAVILITY[:]
-
-        VACANCY_OBJECTTIME = [
-            self.model.TVacancyObjectTime(*row) for _, row in self.model.vacancy_objecttime.iterrows()]
-        self.model.vacancy_objecttimes = VACANCY_OBJECTTIME[:1]
-
-        VACANCY_DETAILS = [
-            self.model.TVacancyDetails(*row) for _, row in self.model.df_vacancy_details.iterrows()
-        ]
+        self.model.guids = GuidTable()
+        MEM_AVAILAVILITY = ColumnStore.from_frame(
+            self.model.TMemberAvailability, self.intern_guids(self.model.df_teamMember_availability))
+        self.model.availabilities = MEM_AVAILAVILITY[
+            ~self.model.df_teamMember_availability.ContactID.isin(self.model.excluded_contacts).values]
+
+        VACANCY_OBJECTTIME = ColumnStore.from_frame(
+            self.model.TVacancyObjectTime, self.intern_guids(self.model.vacancy_objecttime))
+        if self.model.objecttime_ids is None:
+            self.model.vacancy_objecttimes = VACANCY_OBJECTTIME[:1]
+        else:
+            self.model.vacancy_objecttimes = VACANCY_OBJECTTIME[
+                self.model.vacancy_objecttime.ObjectTimeID.isin(self.model.objecttime_ids).values]
+
+        VACANCY_DETAILS = ColumnStore.from_frame(
+            self.model.TVacancyDetails, self.intern_guids(self.model.df_vacancy_details))
         self.model.vacancy_details = VACANCY_DETAILS
-        self.model.get_vacancyid_details = {v.vacancyid: (
-            v.quantity, v.minquantity) for v in self.model.vacancy_details}
+        self.model.get_vacancyid_details = dict(zip(
+            VACANCY_DETAILS.vacancyid.tolist(),
+            zip(VACANCY_DETAILS.quantity.tolist(), VACANCY_DETAILS.minquantity.tolist())))
 
         SHIFT_CONSTRAINTS = [
             self.model.TShiftConstraints(*row) for _, row in self.model.df_shift_constraints.iterrows()]
         self.model.shift_constraints = SHIFT_CONSTRAINTS
 
-        MEM_WORKSITE_REFERENCE = [
-            self.model.TMemberWorksitePreference(*row)
-            for _, row in self.model.df_worksite_reference.iterrows()
-        ]
+        MEM_WORKSITE_REFERENCE = ColumnStore.from_frame(
+            self.model.TMemberWorksitePreference, self.intern_guids(self.model.df_worksite_reference))
         self.model.worksite_refs = MEM_WORKSITE_REFERENCE
 
-        MEM_QUAL = [
-            self.model.TTeamMemberQual(*row) for _, row in self.model.teamMember_qual.iterrows()]
+        MEM_QUAL = ColumnStore.from_frame(
+            self.model.TTeamMemberQual, self.intern_guids(self.model.teamMember_qual))
         self.model.tm_qual = MEM_QUAL
 
+    def add_constraint_block(self, cts=None, names=None, indicators=None, equivalences=None):
+        """Emit one constraint family in bulk through the docplex batch APIs.
+
+        docplex argument checking is switched off for the batch when the model
+        was built with check_args=False. Returns the linear constraints added.
+        """
+        added = []
+        if not self.model.check_args:
+            self.model.set_checker("off")
+        if cts:
+            added = self.model.add_constraints(cts, names)
+        if indicators:
+            self.model.add_indicator_constraints(indicators)
+        if equivalences:
+            self.model.add_equivalence_constraints(equivalences)
+        self.model.set_checker("default")
+        return added
+
     def date2num(self, dt):
         return int((dt - self.model.anchor_date).total_seconds() / 3600)
 
     def convert_time_to_num(self, df, col):
-        df.loc[:, col] = list(map(self.date2num, df[col]))
+        "Parsed datetime column to whole hours since the anchor date (date2num on the whole column)"
+        hours = (df[col].values - np.datetime64(self.model.anchor_date)) / np.timedelta64(1, 'h')
+        df[col] = np.trunc(hours).astype(np.int64)
 
     def init_starttimes(self):
         "Initailizing StartTimes for shifts"
-        start_times = [5, 6, 7, 8, 9, 10, 13, 14, 15, 16]
+        start_times = self.model.start_times or [5, 6, 7, 8, 9, 10, 13, 14, 15, 16]
         self.model.df_shift_start = pd.DataFrame()
         for i, st in enumerate(start_times):
             arr = []
@@ -201,23 +448,29 @@ class SetupData(ModelObjects):
         self.json_input = data
         self.model = model
         self.create_namedtuples()
-        self.read_input_data()
-        self.load_input_data()
+        self.load_input()
         self.load_model_objects()
         self.init_starttimes()
         self.model.VAR = []
         self.model.periods = []
+        self.model.patterns = []
+        self.model.break_length = 0.5
+        # lower bound on unfilled_members from capacity_check
+        self.model.unfilled_lower_bound = 0
         self.shift_len_data = {
             4: {"NBreaks": 0, "NPeriods": 1},
             6: {"NBreaks": 1, "NPeriods": 3},
             8: {"NBreaks": 1, "NPeriods": 3},
             10: {"NBreaks": 2, "NPeriods": 5}
         }
+        if self.model.shift_len_data is not None:
+            self.shift_len_data = self.model.shift_len_data
 
     def getshifthours(self, contactid, timefrom, timeto):
         "Create modified availability start and end time based on open and close hours"
-        shiftopen = [(v.start_hour, v.end_hour, v.objecttimeid)
-                     for v in self.model.vacancy_objecttimes]
+        vacancies = self.model.vacancy_objecttimes
+        shiftopen = zip(vacancies.start_hour.tolist(), vacancies.end_hour.tolist(),
+                        vacancies.objecttimeid.tolist())
         shifthours = []
         for objecttime in shiftopen:
             start, end, id = objecttime
@@ -237,14 +490,14 @@ class SetupData(ModelObjects):
     def get_shift_in_range(self, sh_start, object_time_id):
         "Checks if start and end time exists between range of open and close times"
         LST = []
-        for vacancy in self.model.vacancy_objecttimes:
-            if vacancy.objecttimeid == object_time_id:
+        vacancies = self.model.vacancy_objecttimes
+        for vacancy in vacancies[vacancies.objecttimeid == object_time_id]:
                 starthour = vacancy.start_hour
                 endhour = vacancy.end_hour
                 time_diff = vacancy.end_hour - sh_start
                 for sl in self.shift_len_data:
                     if sl <= time_diff:
-                        var = self.model.binary_var()
+                        var = self.new_shift_var()
                         LST.append((
                             "{0} hour shift".format(sl),
                             object_time_id,
@@ -256,6 +509,14 @@ class SetupData(ModelObjects):
                         ))
         return LST
 
+    def new_shift_var(self):
+        "Decision variable of a candidate shift"
+        return self.model.binary_var()
+
+    def new_pattern_var(self):
+        "Decision variable of a (shift, break pattern) pair"
+        return self.model.binary_var()
+
     def get_shift_length(self, start_time, end_time):
         "Create shift length possiblities based on different start times and end time"
         shift_len_list = []
@@ -271,10 +532,11 @@ class SetupData(ModelObjects):
     def create_shift(self, shifts):
         "creates shifts based on different starttimes and lengths based on availability"
         SHIFTS = []
+        start_hours = set(np.unique(self.model.df_shift_start.values).tolist())
         for shift in shifts:
             __, start, end, id = shift
             for shift_start in range(start, end):
-                if self.model.df_shift_start.isin([shift_start]).sum().sum() > 0:
+                if shift_start in start_hours:
                     SHIFTS.extend(self.get_shift_in_range(shift_start, id))
 
         return [self.model.TShift(*rs) for rs in SHIFTS]
@@ -283,27 +545,42 @@ class SetupData(ModelObjects):
         "get number of periods for each shift based on shift length"
         return self.shift_len_data[shift_len]["NPeriods"] if shift_len in self.shift_len_data else 0
 
-    def setup_data(self):
-        "Setting up shifts to be allocated based on availabilities"
-        temp = []
-        for avail in self.model.availabilities:
-            # print(avail.start_hour,avail.end_hour)
-            shift_list = self.getshifthours(
-                avail.contactid, avail.start_hour, avail.end_hour)
-            # print(avail_start,avail_end)
-            shifts = self.create_shift(shift_list)
-
-            self.model.add_constraint(
-                self.model.sum(sh.var for sh in shifts) <= 1)
+    def create_break_patterns(self, slot=0.25):
+        """Enumerate every legal break placement for each shift length.
 
-            temp = (avail.contactid, avail, shifts)
-            self.model.VAR.append(self.model.TVar(*temp))
-
-        # Creating objects for work periods and break periods
+        Breaks are given as offsets (hours) from the shift start on a `slot` grid:
+        break1 starts 4 to 6 hours in, break2 at least 8 hours in, and both end
+        inside the shift.
+        """
+        self.model.break_patterns = {}
+        for sl in self.shift_len_data:
+            num_breaks = self.get_num_breaks(sl)
+            breaks1 = [None]
+            breaks2 = [None]
+            if num_breaks >= 1:
+                breaks1 = [float(b) for b in np.arange(4, 6 + slot, slot)
+                           if b + self.model.break_length <= sl]
+            if num_breaks >= 2:
+                breaks2 = [float(b) for b in np.arange(8, sl, slot)
+                           if b + self.model.break_length <= sl]
+            self.model.break_patterns[sl] = [
+                tuple(b for b in (b1, b2) if b is not None)
+                for b1 in breaks1 for b2 in breaks2
+            ]
+
+    def create_periods(self, VAR=None):
+        "Creating objects for work periods and break periods (of VAR only when given)"
+        # periods are also grouped per shift (keyed on the shift var) so the
+        # constraint and result builders don't rescan the whole periods list
         k = []
-        for v in self.model.VAR:
+        if VAR is None:
+            VAR = self.model.VAR
+            self.model.shift_periods = {}
+        for v in VAR:
             for sh in v.shift:
                 num_periods = self.get_shift_periods(sh.hours)
+                periods_of_one_shift = self.model.shift_periods.setdefault(
+                    sh.var, [])
                 for period in range(num_periods):
                     work_indicator = self.model.binary_var()
                     break1_indicator = self.model.binary_var()
@@ -313,9 +590,219 @@ class SetupData(ModelObjects):
                     k = (v.contactid, sh, p_start, p_end, work_indicator,
                          break1_indicator, break2_indicator)
                     self.model.periods.append(self.model.TPeriod(*k))
+                    periods_of_one_shift.append(self.model.periods[-1])
+
+    def create_patterns(self, VAR=None):
+        "Creating one binary per (shift, break pattern) instead of period variables (of VAR only when given)"
+        if VAR is None:
+            VAR = self.model.VAR
+            self.create_break_patterns()
+            self.model.shift_patterns = {}
+        for v in VAR:
+            for sh in v.shift:
+                patterns_of_one_shift = self.model.shift_patterns.setdefault(
+                    sh.var, [])
+                for breaks in self.model.break_patterns[sh.hours]:
+                    k = (v.contactid, sh, tuple(sh.start_hour + b for b in breaks),
+                         self.new_pattern_var())
+                    self.model.patterns.append(self.model.TPattern(*k))
+                    patterns_of_one_shift.append(self.model.patterns[-1])
+
+    def instance_hash(self):
+        """sha256 of the normalised instance.
+
+        Covers the seven input tables as loaded (columns and rows sorted), the
+        anchor date, shift lengths and start times, the run settings on the
+        model and the non-default solver parameters.
+        """
+        digest = hashlib.sha256()
+        for name in INPUT_TABLES:
+            df = getattr(self.model, name).astype(str)
+            df = df[sorted(df.columns)]
+            df = df.sort_values(list(df.columns)).reset_index(drop=True)
+            digest.update(df.to_json(orient="split").encode())
+        carry_over = self.model.carry_over
+        if carry_over is not None:
+            carry_over = (sorted((c, sorted(days)) for c, days in carry_over["worked_days"].items()),
+                          sorted(carry_over["week_hours"].items()))
+        settings = (
+            str(self.model.anchor_date),
+            sorted((sl, sorted(data.items())) for sl, data in self.shift_len_data.items()),
+            np.unique(self.model.df_shift_start.values).tolist(),
+            self.model.break_mode,
+            self.model.backend,
+            None if self.model.objecttime_ids is None else sorted(self.model.objecttime_ids),
+            sorted(self.model.excluded_contacts),
+            carry_over,
+            sorted((p.qualified_name, p.get()) for p in self.model.parameters.generate_params()
+                   if p.is_nondefault()),
+        )
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def capacity_check(self):
+        """Upper bound on members on the floor per slot, before anything is built.
+
+        A member can be on the floor at hour h if one of their candidate shifts
+        (the windows of getshifthours, start times of init_starttimes, lengths
+        of shift_len_data, as in create_shift) covers h, whatever object time
+        it belongs to. Capped by Quantity, this bounds the members on floor of
+        every slot; slots where it is below MinimumQuantity cannot be covered
+        and the shortfall summed over the slots is a lower bound on
+        unfilled_members (stored in model.unfilled_lower_bound). Returns one
+        row per slot.
+        """
+        slots = [(vacancy, h) for vacancy in self.model.vacancy_objecttimes
+                 for h in np.arange(vacancy.start_hour, vacancy.end_hour, 0.25)]
+        slot_hours = np.array([h for _, h in slots], dtype=float)
+        hours, slot_hour = np.unique(slot_hours, return_inverse=True)
+        timefrom = self.model.availabilities.start_hour
+        timeto = self.model.availabilities.end_hour
+        start_times = np.unique(self.model.df_shift_start.values)
+        shift_lengths = np.array(sorted(self.shift_len_data))
+        cover = np.zeros((len(timefrom), len(hours)), dtype=bool)
+        for vacancy in self.model.vacancy_objecttimes:
+            start, end = vacancy.start_hour, vacancy.end_hour
+            # shift window per availability, the four cases of getshifthours
+            from_inside = (start <= timefrom) & (timefrom < end)
+            to_inside = (start <= timeto) & (timeto < end)
+            around = (timefrom <= start) & (start < timeto) & (
+                timefrom <= end) & (end < timeto)
+            window_start = np.where(from_inside, timefrom, start)
+            window_end = np.where(to_inside, timeto, end)
+            has_window = from_inside | to_inside | around
+            for sh_start in start_times[(start_times >= start) & (start_times < end)]:
+                lengths = shift_lengths[shift_lengths <= end - sh_start]
+                if len(lengths) == 0:
+                    continue
+                members = has_window & (window_start <= sh_start) & (sh_start < window_end)
+                first = np.searchsorted(hours, sh_start, 'left')
+                last = np.searchsorted(hours, sh_start + lengths.max(), 'right')
+                cover[np.ix_(members, np.arange(first, last))] = True
+
+        capacity = cover.sum(axis=0)[slot_hour]
+        details = [self.model.get_vacancyid_details[vacancy.vacancyid] for vacancy, _ in slots]
+        max_quantity = np.array([quantity for quantity, _ in details], dtype=float)
+        min_quantity = np.array([minQuantity for _, minQuantity in details], dtype=float)
+        capacity = np.minimum(capacity, max_quantity)
+        shortfall = np.maximum(min_quantity - capacity, 0)
+        self.model.unfilled_lower_bound = shortfall.sum()
+        print("Capacity check: {0} of {1} slots cannot reach MinimumQuantity, at least {2} unfilled members".format(
+            int((shortfall > 0).sum()), len(slots), self.model.unfilled_lower_bound))
+        return pd.DataFrame({
+            'Time': [self.convert_to_datetime(h) for _, h in slots],
+            'VacancyID': self.model.guids.decode([vacancy.vacancyid for vacancy, _ in slots]),
+            'ObjectTimeID': self.model.guids.decode([vacancy.objecttimeid for vacancy, _ in slots]),
+            'Capacity': capacity,
+            'MinimumQuantity': min_quantity,
+            'Shortfall': shortfall})
+
+    def setup_data(self):
+        "Setting up shifts to be allocated based on availabilities"
+        self.add_availabilities(self.model.availabilities)
+
+        if self.model.break_mode == "patterns":
+            self.create_patterns()
+        else:
+            self.create_periods()
 
         return
 
+    def create_candidates(self, availabilities):
+        "TVar of every availability, holding the candidate shifts of its getshifthours windows"
+        VAR = []
+        for avail in availabilities:
+            shift_list = self.getshifthours(
+                avail.contactid, avail.start_hour, avail.end_hour)
+            VAR.append(self.model.TVar(avail.contactid, avail, self.create_shift(shift_list)))
+        return VAR
+
+    def add_availabilities(self, availabilities):
+        "Candidate shifts of each availability, one at most; returns the new TVars"
+        VAR = self.create_candidates(availabilities)
+        self.add_constraint_block(
+            [self.model.sum(sh.var for sh in v.shift) <= 1 for v in VAR])
+        self.model.VAR.extend(VAR)
+        return VAR
+
+    def get_slots(self):
+        """15-minute slots of the object times, for the solvers working on an hour grid.
+
+        Returns the (vacancy, h) slots, their MinimumQuantity and Quantity, and
+        the sorted distinct hours with the index of every slot's hour in them
+        (coverage is by hour only, so slots sharing an hour share on_floor).
+        """
+        slots = []
+        quantities = []
+        for vacancy in self.model.vacancy_objecttimes:
+            quantity, minQuantity = self.model.get_vacancyid_details[vacancy.vacancyid]
+            for h in np.arange(vacancy.start_hour, vacancy.end_hour, 0.25):
+                slots.append((vacancy, h))
+                quantities.append((minQuantity, quantity))
+        quantities = np.array(quantities, dtype=float).reshape(-1, 2)
+        hours, slot_hour = np.unique(
+            np.array([h for _, h in slots], dtype=float), return_inverse=True)
+        return slots, quantities[:, 0], quantities[:, 1], hours, slot_hour
+
+    def get_hour_bounds(self, hours, starts, shift_len, offsets):
+        """Hour-grid bounds of shifts of shift_len hours starting at starts, with break offsets.
+
+        Returns the rows lo, hi, blo1, bhi1, blo2, bhi2: a shift is on the floor
+        over hours[lo:hi] minus hours[blo:bhi] of each break (closed work
+        periods, as in SetupConstraints.get_on_floor); missing breaks are (0, 0).
+        """
+        starts = np.asarray(starts, dtype=float)
+        bounds = [np.searchsorted(hours, starts, 'left'),
+                  np.searchsorted(hours, starts + shift_len, 'right')]
+        for k in range(2):
+            if k < len(offsets):
+                bounds += [np.searchsorted(hours, starts + offsets[k], 'right'),
+                           np.searchsorted(hours, starts + offsets[k] + self.model.break_length, 'left')]
+            else:
+                bounds += [np.zeros(len(starts), dtype=int)] * 2
+        return np.array(bounds, dtype=np.int32)
+
+    def sum_on_floor(self, per_hour, bounds):
+        "Sum of per_hour over the hours each shift of get_hour_bounds is on the floor"
+        total = np.concatenate(([0], np.cumsum(per_hour)))
+        lo, hi, blo1, bhi1, blo2, bhi2 = bounds
+        result = total[hi] - total[lo]
+        for blo, bhi in ((blo1, bhi1), (blo2, bhi2)):
+            result -= total[np.maximum(bhi, blo)] - total[blo]
+        return result
+
+    def read_availabilities(self, rows):
+        "TMemberAvailability of Team_Member_Availability rows (input json records), normalised as in load_input_data"
+        if len(rows) == 0:
+            return []
+        df = json_normalize(list(rows))[['ContactID', 'TeamMember', 'StartDateTime', 'EndDateTime']]
+        for col in ['StartDateTime', 'EndDateTime']:
+            df[col] = pd.to_datetime(df[col], format=DATETIME_FORMAT)
+            self.convert_time_to_num(df, col)
+        df = self.intern_guids(df)
+        availabilities = []
+        for row in df.itertuples(index=False):
+            row = list(row)
+            if row[2] == row[3]:
+                row[3] = row[2] + 24
+            availabilities.append(self.model.TMemberAvailability(*row))
+        return availabilities
+
+    def remove_availabilities(self, availabilities):
+        """Fix the shifts of the given availabilities to 0; returns their TVars.
+
+        The variables stay in the model so the constraints built on them
+        are left untouched.
+        """
+        removed = set(availabilities)
+        VAR = [v for v in self.model.VAR if v.time_period in removed]
+        for v in VAR:
+            for sh in v.shift:
+                sh.var.set_ub(0)
+        self.model.availabilities = self.model.availabilities[np.array(
+            [avail not in removed for avail in self.model.availabilities], dtype=bool)]
+        return VAR
+
 
 class SetupConstraints(ModelObjects):
 
@@ -324,133 +811,308 @@ class SetupConstraints(ModelObjects):
         self.model = model
         self.model.day_limit = 10
 
-    def shift_assign_constraint(self):
-        for v in tqdm(self.model.VAR):
+    def shift_assign_constraint(self, VAR=None):
+        cts = []
+        inds = []
+        for v in tqdm(self.model.VAR if VAR is None else VAR):
             shifts = v.shift
-            self.model.add_constraint(self.model.sum(
+            cts.append(self.model.sum(
                 shift.var*(shift.end_hour - shift.start_hour) for shift in shifts) <= self.model.day_limit)
             for sh in v.shift:
-                periods_of_one_shift = [
-                    period
-                    for period in self.model.periods
-                    if period.contactid == v.contactid and period.shift is sh
-                ]
+                periods_of_one_shift = self.model.shift_periods[sh.var]
                 # Break indicator constraints based on shift hours
                 if sh.hours == 4:
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break1_indicator for p in periods_of_one_shift) == 0*sh.var)
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break2_indicator for p in periods_of_one_shift) == 0*sh.var)
                 if sh.hours == 8:
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break1_indicator for p in periods_of_one_shift) == 1*sh.var)
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break2_indicator for p in periods_of_one_shift) == 0*sh.var)
                 if sh.hours == 10:
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break1_indicator for p in periods_of_one_shift) == 1*sh.var)
-                    self.model.add_constraint(self.model.sum(
+                    cts.append(self.model.sum(
                         p.break2_indicator for p in periods_of_one_shift) == 1*sh.var)
 
                 for period in periods_of_one_shift:
                     # period end > period start constraint
-                    self.model.add_constraint(
+                    cts.append(
                         period.period_end >= period.period_start)
                     # period bound constraints
-                    self.model.add_constraint(
+                    cts.append(
                         period.period_start >= sh.start_hour*sh.var)
-                    self.model.add_constraint(
+                    cts.append(
                         period.period_start <= sh.end_hour*sh.var)
-                    self.model.add_constraint(
+                    cts.append(
                         period.period_end >= sh.start_hour*sh.var)
-                    self.model.add_constraint(
+                    cts.append(
                         period.period_end <= sh.end_hour*sh.var)
                     # Indicator bound constraints
-                    self.model.add_constraint(period.work_indicator <= sh.var)
-                    self.model.add_constraint(
+                    cts.append(period.work_indicator <= sh.var)
+                    cts.append(
                         period.break1_indicator <= sh.var)
-                    self.model.add_constraint(
+                    cts.append(
                         period.break2_indicator <= sh.var)
-                    self.model.add_constraint(
+                    cts.append(
                         period.work_indicator + period.break1_indicator + period.break2_indicator
                         == sh.var
                     )
 
                     # Workhour and breakhour constraints
-                    self.model.add_indicator(
-                        period.break1_indicator, period.period_start - sh.start_hour >= 4*sh.var, 1)
-                    self.model.add_indicator(
-                        period.break1_indicator, period.period_start - sh.start_hour <= 6*sh.var, 1)
-                    self.model.add_indicator(
-                        period.break2_indicator, period.period_start - sh.start_hour >= 8*sh.var, 1)
-                    self.model.add_indicator(
-                        period.break1_indicator, period.period_end - period.period_start == 0.5, 1)
-                    self.model.add_indicator(
-                        period.break2_indicator, period.period_end - period.period_start == 0.5, 1)
+                    inds.append(self.model.indicator_constraint(
+                        period.break1_indicator, period.period_start - sh.start_hour >= 4*sh.var, 1))
+                    inds.append(self.model.indicator_constraint(
+                        period.break1_indicator, period.period_start - sh.start_hour <= 6*sh.var, 1))
+                    inds.append(self.model.indicator_constraint(
+                        period.break2_indicator, period.period_start - sh.start_hour >= 8*sh.var, 1))
+                    inds.append(self.model.indicator_constraint(
+                        period.break1_indicator, period.period_end - period.period_start == 0.5, 1))
+                    inds.append(self.model.indicator_constraint(
+                        period.break2_indicator, period.period_end - period.period_start == 0.5, 1))
 
                 # Applying totalhours constraint
-                self.model.add_indicator(
+                inds.append(self.model.indicator_constraint(
                     sh.var,
                     self.model.sum(
                         p.period_end - p.period_start for p in periods_of_one_shift)
                     == sh.hours
-                )
+                ))
 
                 # Applying non overlapping periods constraint
                 for i in range(len(periods_of_one_shift)-1):
-                    self.model.add_constraint(
+                    cts.append(
                         periods_of_one_shift[i].period_end == periods_of_one_shift[i+1].period_start)
 
                 # Constraint setting start and end time for periods
-                self.model.add_indicator(
+                inds.append(self.model.indicator_constraint(
                     sh.var,
-                    periods_of_one_shift[0].period_start == sh.start_hour)
-                self.model.add_indicator(
+                    periods_of_one_shift[0].period_start == sh.start_hour))
+                inds.append(self.model.indicator_constraint(
                     sh.var,
-                    periods_of_one_shift[len(periods_of_one_shift)-1].period_end == sh.end_hour)
+                    periods_of_one_shift[len(periods_of_one_shift)-1].period_end == sh.end_hour))
+
+        self.add_constraint_block(cts, indicators=inds)
+        return
+
+    def pattern_assign_constraint(self, VAR=None):
+        "Each assigned shift picks exactly one of its break patterns"
+        cts = []
+        for v in tqdm(self.model.VAR if VAR is None else VAR):
+            shifts = v.shift
+            cts.append(self.model.sum(
+                shift.var*(shift.end_hour - shift.start_hour) for shift in shifts) <= self.model.day_limit)
+            for sh in v.shift:
+                cts.append(self.model.sum(
+                    p.var for p in self.model.shift_patterns[sh.var]) == sh.var)
+
+        self.add_constraint_block(cts)
         return
 
+    def get_slot_periods(self, start_hour, end_hour, step=0.25):
+        """Map every slot of [start_hour, end_hour) to the periods whose shift covers it.
+
+        Returns the slots and a CSR map (indptr, indices): the periods active at
+        slots[i] are self.cover_items[j] for j in indices[indptr[i]:indptr[i+1]],
+        in the same order as self.cover_items (the periods, or the break patterns
+        in "patterns" mode).
+        """
+        slots = np.arange(start_hour, end_hour, step)
+        first = np.ceil((self.period_shift_start - start_hour) / step)
+        last = np.floor((self.period_shift_end - start_hour) / step)
+        first = np.maximum(first, 0).astype(int)
+        last = np.minimum(last, len(slots) - 1).astype(int)
+        counts = np.maximum(last - first + 1, 0)
+        # expand every period into the slots it covers, then bucket per slot
+        owners = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        slot_ids = np.repeat(first, counts) + offsets
+        indices = owners[np.argsort(slot_ids, kind="stable")]
+        indptr = np.zeros(len(slots) + 1, dtype=int)
+        indptr[1:] = np.cumsum(np.bincount(slot_ids, minlength=len(slots)))
+        return slots, indptr, indices
+
+    def set_cover_items(self, cover_items):
+        "Periods (or break patterns) mapped to slots by get_slot_periods"
+        self.cover_items = cover_items
+        self.period_shift_start = np.array(
+            [p.shift.start_hour for p in self.cover_items], dtype=float)
+        self.period_shift_end = np.array(
+            [p.shift.end_hour for p in self.cover_items], dtype=float)
+
+    def get_cover_slots(self):
+        "(vacancy, h, cover items on the slot) of every 15-minute slot of the object times"
+        for vacancy in self.model.vacancy_objecttimes:
+            slots, indptr, indices = self.get_slot_periods(
+                vacancy.start_hour, vacancy.end_hour)
+            for i, h in enumerate(slots):
+                yield vacancy, h, [self.cover_items[j]
+                                   for j in indices[indptr[i]:indptr[i + 1]]]
+
+    def get_pattern_on_floor(self, h, patterns):
+        """Variables of the break patterns on the floor at hour h.
+
+        On floor unless h falls strictly inside one of the breaks, the same
+        closed work periods as the period formulation.
+        """
+        return [p.var for p in patterns
+                if not any(b < h < b + self.model.break_length for b in p.breaks)]
+
+    def get_hour_breaks(self, hours):
+        """Indices in cover_items of the break patterns on a break at each of hours.
+
+        A shift's patterns sum to the shift, so the patterns on the floor at h
+        (get_pattern_on_floor) add up to the shifts covering h minus these.
+        """
+        breaks = np.full((len(self.cover_items), 2), np.inf)
+        for i, p in enumerate(self.cover_items):
+            breaks[i, :len(p.breaks)] = p.breaks
+        for h in hours:
+            yield np.flatnonzero(((breaks < h) & (h < breaks + self.model.break_length)).any(axis=1))
+
+    def get_on_floor(self, h, var_list, cts, inds):
+        "On floor terms at hour h of the periods (or break patterns) covering it"
+        on_floor_sum = list()
+        if self.model.break_mode == "patterns":
+            on_floor_sum = self.get_pattern_on_floor(h, var_list)
+            var_list = []
+        for p in var_list:
+            ind_var = self.model.binary_var()
+            cts.append(ind_var <= p.work_indicator)
+            inds.append(self.model.indicator_constraint(
+                ind_var, p.period_start <= h, 1))
+            inds.append(self.model.indicator_constraint(
+                ind_var, p.period_end >= h, 1))
+            on_floor = self.model.binary_var()
+            cts.append(
+                on_floor == self.model.logical_and(ind_var, p.shift.var))
+            on_floor_sum.append(on_floor)
+        return on_floor_sum
+
     def vacancy_filling_constraint(self):
         self.model.total_slack_members = list()
-        self.model.debug_onfloor = {}
         self.model.on_floor_members_time = list()
-        for vacancy in self.model.vacancy_objecttimes:
-            minQuantity = self.model.get_vacancyid_details[vacancy.vacancyid][1]
-            maxQuantity = self.model.get_vacancyid_details[vacancy.vacancyid][0]
-            # print(minQuantity,maxQuantity)
-            for h in np.arange(vacancy.start_hour, vacancy.end_hour, 0.25):
-                on_floor_sum = list()
-                slack_members = self.model.integer_var()
-                var_list = [
-                    p for p in self.model.periods if p.shift.start_hour <= h <= p.shift.end_hour]
-                for p in var_list:
-                    ind_var = self.model.binary_var()
-                    self.model.add_constraint(ind_var <= p.work_indicator)
-                    self.model.add_indicator(ind_var, p.period_start <= h, 1)
-                    self.model.add_indicator(ind_var, p.period_end >= h, 1)
-                    on_floor = self.model.binary_var()
-                    self.model.add_constraint(
-                        on_floor == self.model.logical_and(ind_var, p.shift.var))
-                    on_floor_sum.append(on_floor)
-                    
-                
-                # Constraint to set minimum and maximum limit on on floor members
-                on_floor_var = self.model.sum(on_floor_sum)
-                self.model.add_constraint(on_floor_var + slack_members >= minQuantity,
-                                          "Minimum {0} members on floor at any time".format(minQuantity))
-                self.model.add_constraint(
-                    on_floor_var <= maxQuantity, "Max {0} members on floor at any time".format(maxQuantity))
-                self.model.total_slack_members.append(slack_members)
-                self.model.on_floor_members_time.append(on_floor_var)
+        if self.model.break_mode == "patterns":
+            self.set_cover_items(self.model.patterns)
+        else:
+            self.set_cover_items(self.model.periods)
+        cts = []
+        inds = []
+        quantity_cts = []
+        quantity_names = []
+        for vacancy, h, var_list in self.get_cover_slots():
+            maxQuantity, minQuantity = self.model.get_vacancyid_details[vacancy.vacancyid]
+            slack_members = self.model.integer_var()
+            on_floor_sum = self.get_on_floor(h, var_list, cts, inds)
+
+            # Constraint to set minimum and maximum limit on on floor members
+            on_floor_var = self.model.sum(on_floor_sum)
+            quantity_cts.append(on_floor_var + slack_members >= minQuantity)
+            quantity_names.append(
+                "Minimum {0} members on floor at any time".format(minQuantity))
+            quantity_cts.append(on_floor_var <= maxQuantity)
+            quantity_names.append(
+                "Max {0} members on floor at any time".format(maxQuantity))
+            self.model.total_slack_members.append(slack_members)
+            self.model.on_floor_members_time.append(on_floor_var)
+
+        self.add_constraint_block(cts, indicators=inds)
+        added = self.add_constraint_block(quantity_cts, quantity_names)
+        # (minimum, maximum) constraint of every slot, for extend_vacancy_filling
+        self.model.quantity_cts = list(zip(added[0::2], added[1::2]))
+        return
 
+    def extend_vacancy_filling(self, cover_items):
+        "Add the periods (or break patterns) of new shifts to the on floor count of the slots they cover"
+        self.set_cover_items(cover_items)
+        cts = []
+        inds = []
+        for i, (_, h, var_list) in enumerate(self.get_cover_slots()):
+            on_floor_sum = self.get_on_floor(h, var_list, cts, inds)
+            if on_floor_sum:
+                on_floor_var = self.model.sum(on_floor_sum)
+                for ct in self.model.quantity_cts[i]:
+                    ct.lhs = ct.lhs + on_floor_var
+                self.model.on_floor_members_time[i] = self.model.on_floor_members_time[i] + on_floor_var
+        self.add_constraint_block(cts, indicators=inds)
         return
 
+    def add_availability_constraints(self, VAR):
+        "Constraints of the TVars added to a built model by SetupData.add_availabilities"
+        if self.model.break_mode == "patterns":
+            self.pattern_assign_constraint(VAR)
+            self.extend_vacancy_filling(
+                [p for v in VAR for sh in v.shift for p in self.model.shift_patterns[sh.var]])
+        else:
+            self.shift_assign_constraint(VAR)
+            self.extend_vacancy_filling(
+                [p for v in VAR for sh in v.shift for p in self.model.shift_periods[sh.var]])
+        if self.model.carry_over is not None:
+            # contacts may get shifts on new days, rebuild rather than patch
+            self.model.remove_constraints(self.model.horizon_cts)
+            self.horizon_constraint()
+
     def add_constraints(self):
         "Adding model constraints"
-        self.shift_assign_constraint()
+        if self.model.break_mode == "patterns":
+            self.pattern_assign_constraint()
+        else:
+            self.shift_assign_constraint()
         print("Finished allocating breaks constraint")
         self.vacancy_filling_constraint()
         print("Added vacancy filling constraints")
+        if self.model.carry_over is not None:
+            self.horizon_constraint()
+            print("Added rolling horizon constraints")
+
+    def get_horizon_limits(self):
+        """Weekly hours and consecutive working days across the rolling horizon.
+
+        model.carry_over holds what the frozen part of the roster already uses:
+        "worked_days" (contactid -> set of day numbers) and "week_hours"
+        ((contactid, week) -> hours). Weeks are 7-day blocks from the anchor date.
+        Yields (shifts, weighted, limit): the shift hours (weighted) or the
+        number of shifts of shifts may not exceed limit.
+        """
+        shift_constraints = self.model.shift_constraints[0]
+        max_run = shift_constraints.MaxConsecutiveShift
+        worked_days = self.model.carry_over["worked_days"]
+        week_hours = self.model.carry_over["week_hours"]
+        shifts_of_day = {}
+        for v in self.model.VAR:
+            for sh in v.shift:
+                shifts_of_day.setdefault(v.contactid, {}).setdefault(
+                    int(sh.start_hour // 24), []).append(sh)
+
+        for contactid, days in shifts_of_day.items():
+            # carry_over is keyed on the GUIDs
+            guid = self.model.guids[contactid]
+            shifts_of_week = {}
+            for day, shifts in days.items():
+                shifts_of_week.setdefault(day // 7, []).extend(shifts)
+            for week, shifts in shifts_of_week.items():
+                yield shifts, True, shift_constraints.MaxHoursPerWeek - week_hours.get((guid, week), 0)
+
+            # any max_run + 1 consecutive days need a day off
+            known_days = worked_days.get(guid, set())
+            for first in range(min(days) - max_run, max(days) + 1):
+                span = range(first, first + max_run + 1)
+                open_days = [day for day in span if day in days]
+                if len(open_days) == 0:
+                    continue
+                yield ([sh for day in open_days for sh in days[day]], False,
+                       max_run - sum(1 for day in span if day in known_days))
+
+    def horizon_constraint(self):
+        "Constraints of get_horizon_limits"
+        cts = [self.model.sum(sh.var*(sh.end_hour - sh.start_hour) if weighted else sh.var
+                              for sh in shifts) <= limit
+               for shifts, weighted, limit in self.get_horizon_limits()]
+        self.model.horizon_cts = self.add_constraint_block(cts)
+        return
 
 
 class SetupObjectives(ModelObjects):
@@ -469,11 +1131,28 @@ class SetupObjectives(ModelObjects):
         self.model.add_kpi(self.model.total_shifts, "Total shifts assigned")
         self.model.add_kpi(self.model.unfilled_members,
                            "Total unfilled members across the week")
+        # capacity_check bound, lets CPLEX stop as soon as it is reached
+        if self.model.unfilled_lower_bound > 0:
+            self.model.add_constraint(
+                self.model.unfilled_members >= self.model.unfilled_lower_bound, "Capacity lower bound")
         # Minimization function
         self.model.minimize(self.model.unfilled_members)
         print("Done setting up objectives")
         return
 
+    def update_objectives(self, VAR):
+        "Count the shifts of TVars added by SetupData.add_availabilities and refresh the capacity bound"
+        self.model.remove_kpi("Total shifts assigned")
+        self.model.total_shifts = self.model.total_shifts + self.model.sum(
+            sh.var for v in VAR for sh in v.shift)
+        self.model.add_kpi(self.model.total_shifts, "Total shifts assigned")
+        bound = self.model.get_constraint_by_name("Capacity lower bound")
+        if bound is not None:
+            self.model.remove_constraint(bound)
+        if self.model.unfilled_lower_bound > 0:
+            self.model.add_constraint(
+                self.model.unfilled_members >= self.model.unfilled_lower_bound, "Capacity lower bound")
+
 
 class ModelSolve(ModelObjects):
 
@@ -481,14 +1160,224 @@ class ModelSolve(ModelObjects):
         self.input_json = data
         self.model = model
 
-    def solve_model(self):
+    def read_roster(self, source):
+        "Shift_Details frame of a prior roster: output_squirrel.json, Squirrel_Shifts.csv or a DataFrame"
+        if isinstance(source, pd.DataFrame):
+            return source
+        if source.endswith(".csv"):
+            return pd.read_csv(source, index_col=0)
+        with open(source, "r") as file:
+            output = json.load(file)
+        for table in output:
+            if "Shift_Details" in table:
+                return pd.DataFrame(table["Shift_Details"])
+        return pd.DataFrame()
+
+    def to_hour(self, value):
+        "Datetime string to hours since the anchor date (inverse of convert_to_datetime)"
+        return round((pd.to_datetime(value) - self.model.anchor_date).total_seconds() / 3600, 2)
+
+    def add_warm_start(self, source):
+        """Pass a prior roster to CPLEX as a MIP start.
+
+        Each shift is matched on (contact, start, end) to a TShift of this
+        model; its periods (or the break pattern with the same break starts)
+        are set from the roster rows. Shifts with no match, or a second shift
+        in the same availability, are dropped. The start is partial and
+        CPLEX repairs it when the input has changed since.
+        """
+        roster = self.read_roster(source)
+        shift_of = {}
+        for n, v in enumerate(self.model.VAR):
+            for sh in v.shift:
+                shift_of[(v.contactid, sh.start_hour, sh.end_hour)] = (n, sh)
+
+        values = {}
+        used = set()
+        for _, rows in roster.groupby("ShiftID", sort=False):
+            first = rows.iloc[0]
+            match = shift_of.get((self.model.guids.get(first.ContactID), self.to_hour(first.Shift_Start),
+                                  self.to_hour(first.Shift_End)))
+            if match is None or match[0] in used:
+                continue
+            used.add(match[0])
+            sh = match[1]
+            values[sh.var] = 1
+            periods = [(self.to_hour(r.Period_Start), self.to_hour(r.Period_End),
+                        int(r.Work_Indicator), int(r.Break1), int(r.Break2))
+                       for r in rows.itertuples()]
+            if self.model.break_mode == "patterns":
+                breaks = tuple(p_start for p_start, _, _, break1, break2 in periods
+                               if break1 or break2)
+                for pattern in self.model.shift_patterns[sh.var]:
+                    if pattern.breaks == breaks:
+                        values[pattern.var] = 1
+                continue
+            # unused periods collapse onto the shift end as empty work periods
+            for p, period in enumerate(self.model.shift_periods[sh.var]):
+                p_start, p_end, work, break1, break2 = periods[p] if p < len(periods) else (
+                    sh.end_hour, sh.end_hour, 1, 0, 0)
+                values[period.period_start] = p_start
+                values[period.period_end] = p_end
+                values[period.work_indicator] = work
+                values[period.break1_indicator] = break1
+                values[period.break2_indicator] = break2
+
+        print("Warm start: {0} of {1} shifts matched".format(
+            len(used), roster["ShiftID"].nunique() if len(roster) else 0))
+        if values:
+            self.model.add_mip_start(self.model.new_solution(values),
+                                     effort_level=EffortLevel.Repair,
+                                     write_level=WriteLevel.AllVars)
+
+    def solve_model(self, warm_start=None, stream_incumbents=False):
         print("Solving the model...\n")
-        self.model.parameters.mip.tolerances.mipgap.set(1e-01)
+        if warm_start is not None:
+            self.add_warm_start(warm_start)
+        writer = None
+        if stream_incumbents:
+            writer = IncumbentWriter(self.input_json, self.model)
+            self.model.add_progress_listener(writer)
+        if self.model.parameters.mip.tolerances.mipgap.is_default():
+            self.model.parameters.mip.tolerances.mipgap.set(1e-01)
         self.model.parameters.multiobjective.display.set(1)
         solve = self.model.solve()
+        if writer is not None:
+            writer.write_final(solve)
         print("Model solve complete")
         return solve
 
+    def solve_from(self, previous, dropped=()):
+        "Re-solve after a change, starting from the previous solution without the shifts of the dropped TVars"
+        values = dict(previous.iter_var_values())
+        for v in dropped:
+            for sh in v.shift:
+                values.pop(sh.var, None)
+                if self.model.break_mode == "patterns":
+                    for p in self.model.shift_patterns[sh.var]:
+                        values.pop(p.var, None)
+                else:
+                    for p in self.model.shift_periods[sh.var]:
+                        for var in (p.period_start, p.period_end, p.work_indicator,
+                                    p.break1_indicator, p.break2_indicator):
+                            values.pop(var, None)
+        self.model.clear_mip_starts()
+        if values:
+            self.model.add_mip_start(self.model.new_solution(values),
+                                     effort_level=EffortLevel.Repair,
+                                     write_level=WriteLevel.AllVars)
+        return self.solve_model()
+
+
+class LNSSolve(ModelSolve):
+    """Large-neighbourhood search around the built model.
+
+    After a first solve of initial_time seconds (default: half of time_limit,
+    or iteration_time without one), every iteration fixes the shift
+    variables outside a neighbourhood to the incumbent, frees the neighbourhood
+    and re-solves with iteration_time seconds; improvements of unfilled_members
+    are kept.
+    A neighbourhood is `size` random days ("day"), object times ("vacancy")
+    or contacts ("contacts"). model.lns_log holds
+    (seconds, iteration, neighbourhood, objective, best objective).
+    """
+
+    def __init__(self, data, model, neighbourhood="day", size=1, iteration_time=30,
+                 iterations=100, time_limit=None, seed=None, initial_time=None):
+        self.input_json = data
+        self.model = model
+        self.neighbourhood = neighbourhood
+        self.size = size
+        self.iteration_time = iteration_time
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.initial_time = initial_time
+        self.random = random.Random(seed)
+
+    def neighbourhood_key(self, contactid, sh):
+        if self.neighbourhood == "day":
+            return sh.start_hour // 24
+        if self.neighbourhood == "vacancy":
+            return sh.objecttimeid
+        return contactid
+
+    def neighbourhood_label(self, key):
+        "Key of neighbourhood_key as logged: the day, or the GUID of the object time or contact"
+        if self.neighbourhood == "day":
+            return key
+        return self.model.guids[key]
+
+    def fix_shifts(self, incumbent, free_keys=()):
+        "Fix every shift variable to the incumbent, except those in the free neighbourhoods"
+        for v in self.model.VAR:
+            for sh in v.shift:
+                if self.neighbourhood_key(v.contactid, sh) in free_keys:
+                    sh.var.set_lb(0)
+                    sh.var.set_ub(1)
+                else:
+                    sh.var.set_lb(incumbent[sh.var])
+                    sh.var.set_ub(incumbent[sh.var])
+
+    def release_shifts(self):
+        for v in self.model.VAR:
+            for sh in v.shift:
+                sh.var.set_lb(0)
+                sh.var.set_ub(1)
+
+    def solve_model(self, warm_start=None):
+        start_time = time.time()
+        initial_time = self.initial_time
+        if initial_time is None:
+            # leave the neighbourhood search its share of the budget
+            initial_time = self.iteration_time if self.time_limit is None else self.time_limit / 2
+        self.model.parameters.timelimit = initial_time
+        best = ModelSolve.solve_model(self, warm_start)
+        if not best:
+            return best
+        # sub-problems are small, solve them to the default gap
+        self.model.parameters.mip.tolerances.mipgap.reset()
+        keys = sorted(set(self.neighbourhood_key(v.contactid, sh)
+                          for v in self.model.VAR for sh in v.shift))
+        incumbent = {sh.var: int(round(sh.var.solution_value))
+                     for v in self.model.VAR for sh in v.shift}
+        self.model.lns_log = [(time.time() - start_time, 0, None,
+                               best.objective_value, best.objective_value)]
+        last = best
+        for iteration in range(1, self.iterations + 1):
+            if best.objective_value <= 0:
+                break
+            elapsed = time.time() - start_time
+            if self.time_limit is not None and elapsed >= self.time_limit:
+                break
+            self.model.parameters.timelimit = self.iteration_time
+            if self.time_limit is not None:
+                self.model.parameters.timelimit = min(
+                    self.iteration_time, self.time_limit - elapsed)
+            free_keys = set(self.random.sample(keys, min(self.size, len(keys))))
+            self.fix_shifts(incumbent, free_keys)
+            self.model.clear_mip_starts()
+            self.model.add_mip_start(best, effort_level=EffortLevel.Repair)
+            last = self.model.solve()
+            objective = last.objective_value if last else None
+            if last and objective < best.objective_value - 1e-6:
+                best = last
+                incumbent = {sh.var: int(round(sh.var.solution_value))
+                             for v in self.model.VAR for sh in v.shift}
+            self.model.lns_log.append((time.time() - start_time, iteration,
+                                       sorted(self.neighbourhood_label(key) for key in free_keys),
+                                       objective, best.objective_value))
+            print("LNS iteration {0}: objective {1}, best {2}".format(
+                iteration, objective, best.objective_value))
+
+        if last is not best:
+            # reload the best roster so solution_value reads it again
+            self.fix_shifts(incumbent)
+            self.model.clear_mip_starts()
+            self.model.add_mip_start(best, effort_level=EffortLevel.Repair)
+            best = self.model.solve() or best
+        self.release_shifts()
+        return best
+
 
 class CreateResults(ModelObjects):
 
@@ -499,65 +1388,111 @@ class CreateResults(ModelObjects):
 
     def create_results(self):
         if self.solution:
-            print({k:[i.solution_value for i in self.model.debug_onfloor[k]] for k in self.model.debug_onfloor})
-            self.model.report_kpis(solution=self.solution)
-            self.create_hourly_profile()
-            self.create_shifts()
+            self.collect_results()
             self.write_json()
 
+    def collect_results(self):
+        "Extract hourly profile and shifts from the solution without writing them"
+        self.model.report_kpis(solution=self.solution)
+        self.create_hourly_profile()
+        self.create_shifts()
+
     def create_hourly_profile(self):
         # Creating results for hourly profile
         i = 0
         hourly_profile = list()
         for vacancy in self.model.vacancy_objecttimes:
             for h in np.arange(vacancy.start_hour, vacancy.end_hour, 0.25):
-                hourly_profile.append((self.convert_to_datetime(h), vacancy.vacancyid, vacancy.objecttimeid, self.model.total_slack_members[i].solution_value,
-                                       self.model.on_floor_members_time[i].solution_value))
+                hourly_profile.append((self.convert_to_datetime(h), vacancy.vacancyid, vacancy.objecttimeid, self.solution.get_value(self.model.total_slack_members[i]),
+                                       self.solution.get_value(self.model.on_floor_members_time[i])))
                 i += 1
 
-        self.hourly_profile_df = pd.DataFrame(hourly_profile, columns=[
-                                              'Time', 'VacancyID', 'ObjectTimeID', 'Unfilled_Members', 'Members_on_floor'])
+        self.hourly_profile_df = self.create_hourly_profile_frame(hourly_profile)
+
+    def create_hourly_profile_frame(self, hourly_profile):
+        "Hourly_Profile frame from (time, vacancy, object time, unfilled, on floor) rows, with the GUIDs restored"
+        hourly_profile_df = pd.DataFrame(hourly_profile, columns=[
+            'Time', 'VacancyID', 'ObjectTimeID', 'Unfilled_Members', 'Members_on_floor'])
+        hourly_profile_df['VacancyID'] = self.model.guids.decode(hourly_profile_df['VacancyID'])
+        hourly_profile_df['ObjectTimeID'] = self.model.guids.decode(hourly_profile_df['ObjectTimeID'])
+        return hourly_profile_df
 
     def create_shifts(self):
         # Creating Shifts
         k = []
         for v in self.model.VAR:
             for sh in v.shift:
-                shift_assigned = sh.var.solution_value
-                if int(shift_assigned) == 1:
+                shift_assigned = self.solution.get_value(sh.var)
+                if int(round(shift_assigned)) == 1:
                     shift_uid = str(uuid.uuid4()).upper()
-                    periods_shift1 = [p for p in self.model.periods if p.contactid == v.contactid and
-                                      p.shift is sh]
+                    if self.model.break_mode == "patterns":
+                        pattern = [p for p in self.model.shift_patterns[sh.var]
+                                   if int(round(self.solution.get_value(p.var))) == 1][0]
+                        k.extend(self.get_pattern_rows(
+                            v.contactid, shift_uid, sh, pattern.breaks))
+                        continue
+                    periods_shift1 = self.model.shift_periods[sh.var]
                     for p in periods_shift1:
                         period_uid = str(uuid.uuid4())
                         k.append((v.contactid, shift_uid, sh.objecttimeid, self.convert_to_datetime(sh.start_hour), self.convert_to_datetime(sh.end_hour),
-                                  self.convert_to_datetime(p.period_start.solution_value), self.convert_to_datetime(
-                                      p.period_end.solution_value),
-                                  p.work_indicator.solution_value, p.break1_indicator.solution_value,
-                                  p.break2_indicator.solution_value, period_uid))
-
-        self.shifts = pd.DataFrame(k, columns=['ContactID', 'ShiftID', 'ObjectTimeID', 'Shift_Start', 'Shift_End', 'Period_Start',
-                                               'Period_End', 'Work_Indicator', 'Break1', 'Break2', 'Shift_Detail_ID'])
-        self.shifts['Shift_Start'] = self.shifts['Shift_Start'].astype(str)
-        self.shifts['Shift_End'] = self.shifts['Shift_End'].astype(str)
-        self.shifts['Period_Start'] = self.shifts['Period_Start'].astype(str)
-        self.shifts['Period_End'] = self.shifts['Period_End'].astype(str)
-
-        for i in range(len(self.shifts)):
-            self.shifts.loc[i, 'Period_Start'] = self.shifts.loc[i, 'Period_Start'].split(".", 1)[
-                0]
-            self.shifts.loc[i, 'Period_End'] = self.shifts.loc[i, 'Period_End'].split(".", 1)[
-                0]
+                                  self.convert_to_datetime(self.solution.get_value(p.period_start)), self.convert_to_datetime(
+                                      self.solution.get_value(p.period_end)),
+                                  self.solution.get_value(p.work_indicator), self.solution.get_value(p.break1_indicator),
+                                  self.solution.get_value(p.break2_indicator), period_uid))
+
+        self.shifts = self.create_shifts_frame(k)
+
+    def create_shifts_frame(self, k):
+        "Shift_Details frame from (contact, shift, ..., detail id) rows, with the GUIDs restored"
+        shifts = pd.DataFrame(k, columns=['ContactID', 'ShiftID', 'ObjectTimeID', 'Shift_Start', 'Shift_End', 'Period_Start',
+                                          'Period_End', 'Work_Indicator', 'Break1', 'Break2', 'Shift_Detail_ID'])
+        shifts['ContactID'] = self.model.guids.decode(shifts['ContactID'])
+        shifts['ObjectTimeID'] = self.model.guids.decode(shifts['ObjectTimeID'])
+        shifts['Shift_Start'] = shifts['Shift_Start'].astype(str)
+        shifts['Shift_End'] = shifts['Shift_End'].astype(str)
+        shifts['Period_Start'] = shifts['Period_Start'].astype(str)
+        shifts['Period_End'] = shifts['Period_End'].astype(str)
+
+        shifts['Period_Start'] = shifts['Period_Start'].str.split(".", n=1).str[0]
+        shifts['Period_End'] = shifts['Period_End'].str.split(".", n=1).str[0]
+        return shifts
+
+    def set_roster(self, slots, unfilled, on_floor, roster):
+        """Hourly profile and shifts of a roster found without CPLEX.
+
+        slots are the (vacancy, hour) pairs of create_hourly_profile, with the
+        unfilled and on floor members of each, and roster holds one
+        (contactid, shift, break starts) per assigned shift.
+        """
+        self.hourly_profile_df = self.create_hourly_profile_frame([
+            (self.convert_to_datetime(h), vacancy.vacancyid, vacancy.objecttimeid, n_unfilled, n_on_floor)
+            for (vacancy, h), n_unfilled, n_on_floor in zip(slots, unfilled, on_floor)
+        ])
+        k = []
+        for contactid, sh, breaks in roster:
+            k.extend(self.get_pattern_rows(
+                contactid, str(uuid.uuid4()).upper(), sh, breaks))
+        self.shifts = self.create_shifts_frame(k)
+
+    def get_pattern_rows(self, contactid, shift_uid, sh, breaks):
+        "Shift detail rows (work and break periods) of a shift with breaks starting at `breaks`"
+        rows = []
+        period_start = sh.start_hour
+        for n, b in enumerate(breaks):
+            rows.append((period_start, b, 1, 0, 0))
+            rows.append((b, b + self.model.break_length,
+                         0, int(n == 0), int(n == 1)))
+            period_start = b + self.model.break_length
+        rows.append((period_start, sh.end_hour, 1, 0, 0))
+        return [
+            (contactid, shift_uid, sh.objecttimeid, self.convert_to_datetime(sh.start_hour), self.convert_to_datetime(sh.end_hour),
+             self.convert_to_datetime(p_start), self.convert_to_datetime(p_end),
+             work, break1, break2, str(uuid.uuid4()))
+            for p_start, p_end, work, break1, break2 in rows
+        ]
 
-    def write_json(self):
-        # Creating output sample
-        self.hourly_profile_df['Time'] = self.hourly_profile_df['Time'].astype(
-            str)
-        # Build sample outputs
-        self.hourly_profile_df.name = 'Hourly_Profile'
-        self.shifts.name = 'Shift_Details'
-        self.shifts.to_csv('Squirrel_Shifts.csv')
-        self.hourly_profile_df.to_csv('Hourly_Profile.csv')
+    def output_records(self):
+        "Content of output_squirrel.json"
         k = []
         output_list = [self.hourly_profile_df, self.shifts]
         for df in output_list:
@@ -565,22 +1500,808 @@ class CreateResults(ModelObjects):
             #temp_df = df.iloc[:1]
             temp_dict[df.name] = df.to_dict(orient='records')
             k.append(temp_dict)
+        return k
+
+    def load_records(self, records):
+        "Hourly profile and shifts from the content of an output_squirrel.json"
+        self.hourly_profile_df = pd.DataFrame(records[0]['Hourly_Profile'])
+        self.shifts = pd.DataFrame(records[1]['Shift_Details'])
+
+    def write_json(self):
+        # Creating output sample
+        self.hourly_profile_df['Time'] = self.hourly_profile_df['Time'].astype(
+            str)
+        # Build sample outputs
+        self.hourly_profile_df.name = 'Hourly_Profile'
+        self.shifts.name = 'Shift_Details'
+        # every file is written next to its target and renamed over it, so
+        # readers never see a partial file while incumbents are streamed
+        self.shifts.to_csv('Squirrel_Shifts.csv.tmp')
+        os.replace('Squirrel_Shifts.csv.tmp', 'Squirrel_Shifts.csv')
+        self.hourly_profile_df.to_csv('Hourly_Profile.csv.tmp')
+        os.replace('Hourly_Profile.csv.tmp', 'Hourly_Profile.csv')
 
         import json
-        with open("output_squirrel.json", 'w') as outfile:
-            outfile.write(json.dumps(k))
+        with open("output_squirrel.json.tmp", 'w') as outfile:
+            outfile.write(json.dumps(self.output_records()))
+        os.replace("output_squirrel.json.tmp", "output_squirrel.json")
+
+
+class IncumbentWriter(SolutionListener):
+    """Writes every improving incumbent while CPLEX is still solving.
+
+    Each better solution goes through the CreateResults extraction and
+    atomically replaces output_squirrel.json (and the CSVs); a row of time,
+    objective, best bound and gap is appended to log_path. write_final adds
+    the row of the solution solve() returns, so the log ends at it.
+    """
+
+    def __init__(self, data, model, log_path="Progress_Log.csv"):
+        SolutionListener.__init__(self)
+        self.input_json = data
+        self.model = model
+        self.log_path = log_path
+        self.best_objective = None
+
+    def notify_start(self):
+        SolutionListener.notify_start(self)
+        self.best_objective = None
+        with open(self.log_path, "w") as log:
+            log.write("Seconds,Objective,Best_Bound,Gap\n")
+
+    def notify_solution(self, sol):
+        progress = self.current_progress_data
+        if self.best_objective is not None and progress.current_objective >= self.best_objective:
+            return
+        self.best_objective = progress.current_objective
+        results = CreateResults(self.input_json, self.model, sol)
+        results.create_hourly_profile()
+        results.create_shifts()
+        results.write_json()
+        with open(self.log_path, "a") as log:
+            log.write("{0:.2f},{1},{2},{3}\n".format(
+                progress.time, progress.current_objective, progress.best_bound, progress.mip_gap))
+        print("Incumbent {0} written after {1:.1f}s".format(
+            progress.current_objective, progress.time))
+
+    def write_final(self, solution):
+        "Last row of the log, from the solution returned by solve() and its solve details"
+        if not solution:
+            return
+        details = solution.solve_details
+        with open(self.log_path, "a") as log:
+            log.write("{0:.2f},{1},{2},{3}\n".format(
+                details.time, solution.objective_value, details.best_bound, details.mip_relative_gap))
+
+
+class GreedyRoster(SetupData):
+    """Constructive roster heuristic that needs no solver.
+
+    Uses the same candidate shifts as SetupData and the break patterns of the
+    "patterns" mode, and repeatedly picks the (shift, break pattern) covering
+    the most under-covered 15-minute slots, one shift per availability, never
+    going over Quantity on the floor. Coverage follows vacancy_filling_constraint.
+    Gains are kept per candidate; after every pick only the candidates over
+    the hours whose coverage changed are evaluated again.
+    """
+
+    def new_shift_var(self):
+        return None
+
+    def setup_data(self):
+        "Candidate shifts per availability, without any model variables"
+        self.model.VAR.extend(self.create_candidates(self.model.availabilities))
+        self.create_break_patterns()
+
+    def create_roster(self):
+        "Greedy roster: model.greedy_roster holds (contactid, shift, breaks) per assigned shift"
+        slots, min_quantity, max_quantity, hours, slot_hour = self.get_slots()
+
+        # one column of bounds per (availability, shift, break pattern),
+        # computed per (shift length, break pattern) group
+        candidates = []
+        groups = {}
+        for n, v in enumerate(self.model.VAR):
+            for sh in v.shift:
+                for offsets in self.model.break_patterns[sh.hours]:
+                    groups.setdefault((sh.hours, offsets), []).append(len(candidates))
+                    candidates.append((n, v.contactid, sh, tuple(sh.start_hour + o for o in offsets)))
+        bounds = np.zeros((6, len(candidates)), dtype=np.int32)
+        for (shift_len, offsets), index in groups.items():
+            bounds[:, index] = self.get_hour_bounds(
+                hours, [candidates[i][2].start_hour for i in index], shift_len, offsets)
+        availability = np.array([n for n, _, _, _ in candidates], dtype=int)
+        lo, hi, blo1, bhi1, blo2, bhi2 = bounds
+        break_ranges = [(blo1, bhi1), (blo2, bhi2)]
+
+        def score(need, full, index=slice(None)):
+            "Under-covered hours of the candidates at index, 0 once one of their hours is full"
+            return np.where(self.sum_on_floor(full, bounds[:, index]) > 0, 0,
+                            self.sum_on_floor(need, bounds[:, index]))
+
+        def coverage(i):
+            "On-floor indicator per hour of candidate i"
+            working = np.zeros(len(hours))
+            working[lo[i]:hi[i]] = 1
+            for blo, bhi in break_ranges:
+                working[blo[i]:bhi[i]] = 0
+            return working
+
+        on_floor = np.zeros(len(hours))
+        need = np.bincount(slot_hour, on_floor[slot_hour] < min_quantity, len(hours))
+        full = np.bincount(slot_hour, on_floor[slot_hour] >= max_quantity, len(hours))
+        gain = score(need, full)
+        self.model.greedy_roster = []
+        while len(gain):
+            best = int(np.argmax(gain))
+            if gain[best] == 0:
+                break
+            n, contactid, sh, breaks = candidates[best]
+            self.model.greedy_roster.append((contactid, sh, breaks))
+            on_floor += coverage(best)
+            gain[availability == n] = 0
+            new_need = np.bincount(slot_hour, on_floor[slot_hour] < min_quantity, len(hours))
+            new_full = np.bincount(slot_hour, on_floor[slot_hour] >= max_quantity, len(hours))
+            changed = np.flatnonzero((new_need != need) | (new_full != full))
+            need, full = new_need, new_full
+            if len(changed) == 0:
+                continue
+            # gains only drop, so candidates at 0 stay out
+            touched = np.flatnonzero((gain > 0) & (lo <= changed[-1]) & (hi > changed[0]))
+            gain[touched] = score(need, full, touched)
+        on_floor = on_floor[slot_hour]
+
+        self.model.greedy_slots = slots
+        self.model.greedy_on_floor = on_floor
+        self.model.greedy_unfilled = np.maximum(min_quantity - on_floor, 0)
+        print("Greedy roster: {0} shifts, {1} unfilled members".format(
+            len(self.model.greedy_roster), self.model.greedy_unfilled.sum()))
+
+    def create_results(self):
+        "Hourly_Profile and Shift_Details of the greedy roster, in the CreateResults format"
+        results = CreateResults(self.json_input, self.model, None)
+        results.set_roster(self.model.greedy_slots, self.model.greedy_unfilled,
+                           self.model.greedy_on_floor, self.model.greedy_roster)
+        return results
+
+
+class ColumnGeneration(SetupData):
+    """Column generation over (availability, shift start, length, break pattern) columns.
+
+    The LP master has one [0, 1] variable per generated column, at most one
+    column per availability, and the minimum/maximum members on floor of every
+    15-minute slot as in SetupConstraints.vacancy_filling_constraint (a column
+    covers a slot by hour, off the floor strictly inside its breaks). Columns
+    are priced with the slot duals over shift starts every start_step hours
+    inside the availability windows of getshifthours, so no start time list is
+    needed. The roster is the master solved as a MIP over the generated columns.
+    """
+
+    def __init__(self, data, model, start_step=0.25, max_iterations=50):
+        SetupData.__init__(self, data, model)
+        self.start_step = start_step
+        self.max_iterations = max_iterations
+
+    def setup_master(self):
+        "Empty master: slack and the minimum/maximum rows per slot"
+        self.create_break_patterns()
+        self.slots, min_quantity, max_quantity, self.hours, self.slot_hour = self.get_slots()
+        order = np.argsort(self.slot_hour, kind="stable")
+        self.hour_slots = np.split(order, np.cumsum(
+            np.bincount(self.slot_hour, minlength=len(self.hours)))[:-1])
+
+        self.model.total_slack_members = self.model.continuous_var_list(
+            len(self.slots), lb=0)
+        self.min_cts = self.model.add_constraints(
+            [self.model.linear_expr() + slack >= minQuantity
+             for slack, minQuantity in zip(self.model.total_slack_members, min_quantity)])
+        self.max_cts = self.model.add_constraints(
+            [self.model.linear_expr() <= quantity for quantity in max_quantity])
+        # availability rows are added with their first column
+        self.availability_cts = {}
+        self.model.minimize(self.model.sum(self.model.total_slack_members))
+        self.model.columns = []
+
+    def setup_candidates(self):
+        """Hour-grid bounds (get_hour_bounds) of every candidate column, grouped by availability.
+
+        Starts lie on the start_step grid of each
+        availability window and the shift ends inside the object time.
+        """
+        vacancy_end = {v.objecttimeid: v.end_hour for v in self.model.vacancy_objecttimes}
+        bounds = []
+        # candidates come in blocks (availability, object time, length, breaks) over a start grid
+        self.blocks = []
+        self.segments = [0]
+        count = 0
+        for n, avail in enumerate(self.model.availabilities):
+            for _, start, end, objecttimeid in self.getshifthours(
+                    avail.contactid, avail.start_hour, avail.end_hour):
+                starts = np.arange(start, end, self.start_step)
+                for sl, patterns in self.model.break_patterns.items():
+                    starts_sl = starts[starts + sl <= vacancy_end[objecttimeid]]
+                    if len(starts_sl) == 0:
+                        continue
+                    for offsets in patterns:
+                        bounds.append(self.get_hour_bounds(self.hours, starts_sl, sl, offsets))
+                        self.blocks.append((count, n, objecttimeid, sl, offsets, starts_sl))
+                        count += len(starts_sl)
+            self.segments.append(count)
+        self.bounds = np.concatenate(bounds, axis=1) if bounds else np.zeros(
+            (6, 0), dtype=np.int32)
+        self.block_first = np.array([block[0] for block in self.blocks], dtype=int)
+        print("Column generation: {0} candidate columns".format(count))
+
+    def price(self):
+        "Reduced cost of every candidate under the current duals"
+        slot_duals = (np.array(self.model.dual_values(self.min_cts)) +
+                      np.array(self.model.dual_values(self.max_cts)))
+        value = self.sum_on_floor(np.bincount(
+            self.slot_hour, slot_duals, len(self.hours)), self.bounds)
+        availability_duals = np.zeros(len(self.model.availabilities))
+        for n, ct in self.availability_cts.items():
+            availability_duals[n] = ct.dual_value
+        return -availability_duals[np.repeat(
+            np.arange(len(self.model.availabilities)), np.diff(self.segments))] - value
+
+    def add_column(self, i):
+        "Add candidate i to the master"
+        first, n, objecttimeid, sl, offsets, starts = self.blocks[
+            np.searchsorted(self.block_first, i, 'right') - 1]
+        start = float(starts[i - first])
+        lo, hi, blo1, bhi1, blo2, bhi2 = self.bounds[:, i]
+        var = self.model.continuous_var(ub=1)
+        covered = np.ones(hi - lo, dtype=bool)
+        for blo, bhi in ((blo1, bhi1), (blo2, bhi2)):
+            covered[max(blo - lo, 0):max(bhi - lo, 0)] = False
+        for u in np.arange(lo, hi)[covered]:
+            for s in self.hour_slots[u]:
+                self.min_cts[s].lhs.add_term(var, 1)
+                self.max_cts[s].lhs.add_term(var, 1)
+        if n in self.availability_cts:
+            self.availability_cts[n].lhs.add_term(var, 1)
+        else:
+            self.availability_cts[n] = self.model.add_constraint(
+                self.model.linear_expr(var) <= 1)
+        avail = self.model.availabilities[n]
+        sh = self.model.TShift("{0} hour shift".format(sl), objecttimeid, start, start + sl,
+                               self.get_num_breaks(sl), sl, var)
+        self.model.columns.append(
+            (avail.contactid, sh, tuple(start + o for o in offsets), np.arange(lo, hi)[covered]))
+
+    def solve_model(self):
+        "Price columns until none improves the LP, then solve the restricted master as a MIP"
+        self.setup_master()
+        self.setup_candidates()
+        for iteration in range(self.max_iterations):
+            solution = self.model.solve()
+            reduced_costs = self.price()
+            added = 0
+            for first, last in zip(self.segments[:-1], self.segments[1:]):
+                if first == last:
+                    continue
+                best = first + int(np.argmin(reduced_costs[first:last]))
+                if reduced_costs[best] < -1e-6:
+                    self.add_column(best)
+                    added += 1
+            print("Column generation iteration {0}: LP {1}, {2} columns added".format(
+                iteration, solution.objective_value, added))
+            if added == 0:
+                break
+        self.model.change_var_types(
+            [sh.var for _, sh, _, _ in self.model.columns], "B")
+        return self.model.solve()
+
+    def create_results(self):
+        "Hourly_Profile and Shift_Details of the restricted master MIP, in the CreateResults format"
+        roster = [(contactid, sh, breaks) for contactid, sh, breaks, _ in self.model.columns
+                  if int(round(sh.var.solution_value)) == 1]
+        on_floor = np.zeros(len(self.hours))
+        for contactid, sh, breaks, covered in self.model.columns:
+            if int(round(sh.var.solution_value)) == 1:
+                on_floor[covered] += 1
+        results = CreateResults(self.json_input, self.model, None)
+        results.set_roster(self.slots,
+                           [slack.solution_value for slack in self.model.total_slack_members],
+                           on_floor[self.slot_hour], roster)
+        return results
+
+
+class CPSATRoster(GreedyRoster):
+    """The "patterns" model built and solved with OR-Tools CP-SAT instead of CPLEX.
+
+    Same candidate shifts, break patterns, constraints (including the rolling
+    horizon ones) and objective as SetupConstraints/SetupObjectives, without
+    the community edition size limits. Shift lengths are whole hours, so every
+    coefficient is integral. Only availabilities overlapping an object time
+    get variables, and the greedy roster (GreedyRoster) is the solution hint.
+    model.parameters threads and timelimit are passed on as CP-SAT workers and
+    time limit; with a time limit, probing and symmetry detection are skipped
+    in presolve, which otherwise take most of a short run. ortools is only
+    needed here.
+    """
+
+    def __init__(self, data, model):
+        if cp_model is None:
+            raise ImportError("The cpsat backend needs ortools (pip install ortools)")
+        self.cp = cp_model.CpModel()
+        self.solver = None
+        SetupData.__init__(self, data, model)
+
+    def new_shift_var(self):
+        return self.cp.NewBoolVar("")
+
+    def new_pattern_var(self):
+        return self.cp.NewBoolVar("")
+
+    def setup_data(self):
+        "Candidate shifts of the availabilities overlapping an object time (at most one assigned) and their break patterns"
+        availabilities = self.model.availabilities
+        overlaps = np.zeros(len(availabilities), dtype=bool)
+        for vacancy in self.model.vacancy_objecttimes:
+            overlaps |= ((availabilities.start_hour < vacancy.end_hour) &
+                         (availabilities.end_hour > vacancy.start_hour))
+        VAR = self.create_candidates(availabilities[overlaps])
+        for v in VAR:
+            self.cp.AddAtMostOne(sh.var for sh in v.shift)
+        self.model.VAR.extend(VAR)
+        self.create_patterns()
+
+    def add_constraints(self):
+        """Mirror of SetupConstraints.add_constraints in "patterns" mode, and the objective.
+
+        Slots sharing an hour share one members on floor variable, the shifts
+        covering the hour minus the break patterns on a break (see
+        SetupConstraints.get_hour_breaks). The greedy roster is given as hint
+        (add_hint).
+        """
+        setup_constraints = SetupConstraints(self.json_input, self.model)
+        for v in self.model.VAR:
+            self.cp.Add(cp_model.LinearExpr.WeightedSum(
+                [sh.var for sh in v.shift], [int(sh.hours) for sh in v.shift]) <= self.model.day_limit)
+            for sh in v.shift:
+                self.cp.Add(cp_model.LinearExpr.Sum(
+                    [p.var for p in self.model.shift_patterns[sh.var]]) == sh.var)
+
+        setup_constraints.set_cover_items(self.model.patterns)
+        self.slots, min_quantity, max_quantity, hours, slot_hour = self.get_slots()
+        pattern_vars = [p.var for p in self.model.patterns]
+        shifts = [sh for v in self.model.VAR for sh in v.shift]
+        shift_start = np.array([sh.start_hour for sh in shifts], dtype=float)
+        shift_end = np.array([sh.end_hour for sh in shifts], dtype=float)
+        hour_shifts = []
+        hour_breaks = []
+        hour_on_floor = []
+        for h, on_break in zip(hours, setup_constraints.get_hour_breaks(hours)):
+            on_shift = np.flatnonzero((shift_start <= h) & (h <= shift_end))
+            hour_shifts.append(on_shift)
+            hour_breaks.append(on_break)
+            on_floor = self.cp.NewIntVar(0, len(on_shift), "")
+            self.cp.Add(on_floor == cp_model.LinearExpr.Sum([shifts[j].var for j in on_shift]) -
+                        cp_model.LinearExpr.Sum([pattern_vars[j] for j in on_break]))
+            hour_on_floor.append(on_floor)
+        self.total_slack_members = []
+        self.on_floor_members_time = []
+        for n, minQuantity, maxQuantity in zip(slot_hour, min_quantity, max_quantity):
+            slack_members = self.cp.NewIntVar(0, int(minQuantity), "")
+            self.cp.Add(hour_on_floor[n] + slack_members >= int(minQuantity))
+            self.cp.Add(hour_on_floor[n] <= int(maxQuantity))
+            self.total_slack_members.append(slack_members)
+            self.on_floor_members_time.append(hour_on_floor[n])
+
+        if self.model.carry_over is not None:
+            # shift hours are whole, so the weekly limit can be rounded down
+            for limited, weighted, limit in setup_constraints.get_horizon_limits():
+                self.cp.Add(cp_model.LinearExpr.WeightedSum(
+                    [sh.var for sh in limited], [int(sh.hours) if weighted else 1 for sh in limited])
+                    <= math.floor(limit))
+        self.cp.Minimize(cp_model.LinearExpr.Sum(self.total_slack_members))
+
+        self.add_hint(setup_constraints, shifts, hour_shifts, hour_breaks, hour_on_floor, min_quantity, slot_hour)
+
+    def add_hint(self, setup_constraints, shifts, hour_shifts, hour_breaks, hour_on_floor,
+                 min_quantity, slot_hour):
+        """Hint the greedy roster (GreedyRoster.create_roster over the same candidates).
+
+        With a carry over, the hinted shifts of any contact over a horizon limit
+        are left out, so the hint stays feasible.
+        """
+        self.create_roster()
+        chosen = {(id(sh), breaks) for _, sh, breaks in self.model.greedy_roster}
+        hinted = np.array([(id(p.shift), p.breaks) in chosen for p in self.model.patterns], dtype=bool)
+        on = {id(sh) for _, sh, _ in self.model.greedy_roster}
+        if self.model.carry_over is not None:
+            for limited, weighted, limit in setup_constraints.get_horizon_limits():
+                used = sum((sh.hours if weighted else 1) for sh in limited if id(sh) in on)
+                if used > math.floor(limit):
+                    on.difference_update(id(sh) for sh in limited)
+            hinted &= np.array([id(p.shift) in on for p in self.model.patterns], dtype=bool)
+        shift_on = np.array([id(sh) in on for sh in shifts], dtype=bool)
+
+        for p, value in zip(self.model.patterns, hinted):
+            self.cp.AddHint(p.var, bool(value))
+        for sh, value in zip(shifts, shift_on):
+            self.cp.AddHint(sh.var, bool(value))
+        on_floor = np.array([shift_on[on_shift].sum() - hinted[on_break].sum()
+                             for on_shift, on_break in zip(hour_shifts, hour_breaks)], dtype=int)
+        for var, value in zip(hour_on_floor, on_floor):
+            self.cp.AddHint(var, int(value))
+        for slack_members, minQuantity, n in zip(self.total_slack_members, min_quantity, slot_hour):
+            self.cp.AddHint(slack_members, max(int(minQuantity) - int(on_floor[n]), 0))
+
+    def solve_model(self):
+        "Solve with CP-SAT; returns the solver, or None without a feasible roster"
+        print("Solving the model with CP-SAT...\n")
+        self.solver = cp_model.CpSolver()
+        self.solver.parameters.num_workers = int(self.model.parameters.threads.get())
+        time_limit = self.model.parameters.timelimit.get()
+        if time_limit < 1e75:
+            self.solver.parameters.max_time_in_seconds = time_limit
+            self.solver.parameters.symmetry_level = 0
+            self.solver.parameters.cp_model_probing_level = 0
+        status = self.solver.Solve(self.cp)
+        print("Model solve complete: {0}, unfilled members {1}".format(
+            self.solver.StatusName(status), self.solver.ObjectiveValue()))
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return None
+        return self.solver
+
+    def create_results(self):
+        "Hourly_Profile and Shift_Details of the CP-SAT roster, in the CreateResults format"
+        roster = [(p.contactid, p.shift, p.breaks)
+                  for p in self.model.patterns if self.solver.BooleanValue(p.var)]
+        results = CreateResults(self.json_input, self.model, None)
+        results.set_roster(self.slots,
+                           [self.solver.Value(x) for x in self.total_slack_members],
+                           [self.solver.Value(x) for x in self.on_floor_members_time],
+                           roster)
+        return results
+
+
+# Parameter sets raced by ModelBuild.create_model_run_portfolio, as dotted
+# CPLEX parameter paths; the last one is parameter_set_with_timelimit of 1.0.0
+PORTFOLIO = {
+    "default": {},
+    "feasibility": {"emphasis.mip": 1, "mip.strategy.heuristicfreq": 10},
+    "optimality": {"emphasis.mip": 2},
+    "bestbound": {"emphasis.mip": 3, "randomseed": 7},
+    "hiddenfeas": {"emphasis.mip": 4, "mip.strategy.rinsheur": 20},
+    "aggregator": {"preprocessing.aggregator": 0, "mip.polishafter.solutions": 2},
+}
+
+
+class PortfolioCallback(MIPInfoCallback):
+    "Streams new incumbents to the parent and aborts once another worker has met the target gap"
+
+    def __call__(self):
+        if self.stop.is_set():
+            self.abort()
+            return
+        if self.has_incumbent():
+            objective = self.get_incumbent_objective_value()
+            if self.incumbent is None or objective < self.incumbent:
+                self.incumbent = objective
+                self.messages.put(("incumbent", self.name, self.get_time() - self.get_start_time(),
+                                   objective, self.get_MIP_relative_gap()))
+
+
+def solve_parameter_set(path, name, parameters, threads, time_limit, target_gap, stop, messages):
+    "Solve the exported model under one parameter set (run in a worker process)"
+    try:
+        cpx = cplex.Cplex(path)
+        cpx.set_log_stream(None)
+        cpx.set_results_stream(None)
+        cpx.parameters.threads.set(threads)
+        cpx.parameters.timelimit.set(time_limit)
+        cpx.parameters.mip.tolerances.mipgap.set(target_gap)
+        for parameter, value in parameters.items():
+            reduce(getattr, parameter.split("."), cpx.parameters).set(value)
+        callback = cpx.register_callback(PortfolioCallback)
+        callback.name, callback.stop, callback.messages = name, stop, messages
+        callback.incumbent = None
+        cpx.solve()
+        if cpx.solution.is_primal_feasible():
+            gap = cpx.solution.MIP.get_mip_relative_gap()
+            if gap <= target_gap:
+                stop.set()
+            messages.put(("done", name, cpx.solution.get_objective_value(), gap,
+                          list(cpx.solution.get_values())))
+        else:
+            messages.put(("done", name, None, None, None))
+    except Exception as e:
+        messages.put(("done", name, None, None, str(e)))
+
+
+def solve_partition(data, key, objecttime_ids, excluded_contacts, settings):
+    "Build and solve one partition of the instance (run in a worker process)"
+    mb = ModelBuild.from_settings(data, None, settings)
+    mb.model.objecttime_ids = set(objecttime_ids)
+    mb.model.excluded_contacts = set(excluded_contacts)
+    results = mb.create_model_results()
+    if results is None:
+        print("Partition {0}: no solution".format(key))
+        return key, None, None
+    return key, results.hourly_profile_df, results.shifts
+
+
+def apply_overrides(input_json, overrides, path):
+    """Write a copy of the input json with Vacancy_details overrides to path.
+
+    overrides maps a Vacancy_details column (Quantity, MinimumQuantity) to one
+    value for every vacancy, or to a {VacancyID: value} dict.
+    """
+    with open(input_json, "r") as file:
+        contents = json.load(file)
+    for column, value in overrides.items():
+        for vacancy in contents['Vacancy_details']:
+            if isinstance(value, dict):
+                vacancy[column] = value.get(vacancy['VacancyID'], vacancy[column])
+            else:
+                vacancy[column] = value
+    with open(path, "w") as file:
+        json.dump(contents, file)
+    return path
+
+
+# Columns of Batch_Summary.csv, one row per scenario of run_batch
+BATCH_SUMMARY_COLUMNS = ['Scenario', 'Status', 'Runtime', 'Objective', 'MIP_Gap', 'Unfilled_Members',
+                         'Shifts_Assigned', 'Capacity_Lower_Bound']
+
+
+def run_scenario(scenario, output_dir, time_limit, memory_limit, threads):
+    """Roster one scenario of run_batch in output_dir (run in a worker process).
+
+    Returns the summary row of the scenario: status, runtime and KPIs.
+    """
+    start_time = time.time()
+    scenario_id = scenario['scenario_id']
+    time_limit = scenario.get('time_limit', time_limit)
+    memory_limit = scenario.get('memory_limit', memory_limit)
+    summary = dict.fromkeys(BATCH_SUMMARY_COLUMNS)
+    summary['Scenario'] = scenario_id
+    cwd = os.getcwd()
+    os.makedirs(output_dir, exist_ok=True)
+    limits = None
+    try:
+        if resource is not None and memory_limit is not None:
+            # soft limit only, so it is restored for the next scenario of this worker
+            limits = resource.getrlimit(resource.RLIMIT_AS)
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit * 1024 * 1024, limits[1]))
+        with open(os.path.join(output_dir, "run.log"), "w") as log, contextlib.redirect_stdout(log):
+            data = os.path.abspath(scenario['data'])
+            overrides = {column: scenario[column] for column in ('Quantity', 'MinimumQuantity')
+                         if column in scenario}
+            if overrides:
+                data = apply_overrides(data, overrides, os.path.abspath(
+                    os.path.join(output_dir, "input_squirrel.json")))
+            os.chdir(output_dir)
+            mb = ModelBuild(data, scenario_id, scenario.get('break_mode', "periods"),
+                            backend=scenario.get('backend', "cplex"))
+            if 'shift_lengths' in scenario:
+                mb.model.shift_len_data = {
+                    int(sl): lengths for sl, lengths in scenario['shift_lengths'].items()}
+            mb.model.start_times = scenario.get('start_times')
+            for parameter, value in scenario.get('parameters', {}).items():
+                reduce(getattr, parameter.split("."), mb.model.parameters).set(value)
+            if threads is not None:
+                mb.model.parameters.threads = threads
+            if time_limit is not None:
+                mb.model.parameters.timelimit = time_limit
+            if memory_limit is not None:
+                # keep CPLEX under the cap, spilling the tree to compressed node files
+                mb.model.parameters.workmem = memory_limit / 2
+                mb.model.parameters.mip.strategy.file = 3
+            mb.create_model_run()
+        summary['Capacity_Lower_Bound'] = mb.model.unfilled_lower_bound
+        results = getattr(mb, 'Create_Results', None)
+        if results is None or not hasattr(results, 'shifts'):
+            summary['Status'] = "no solution"
+        else:
+            summary['Status'] = "solved"
+            summary['Unfilled_Members'] = results.hourly_profile_df.Unfilled_Members.sum()
+            summary['Shifts_Assigned'] = results.shifts.ShiftID.nunique() if len(results.shifts) else 0
+            if getattr(mb, 'solution', None):
+                summary['Objective'] = mb.solution.objective_value
+                summary['MIP_Gap'] = mb.solution.solve_details.mip_relative_gap
+    except MemoryError:
+        summary['Status'] = "memory limit"
+    except Exception as e:
+        summary['Status'] = "failed: {0}".format(e)
+    finally:
+        os.chdir(cwd)
+        if limits is not None:
+            resource.setrlimit(resource.RLIMIT_AS, limits)
+    summary['Runtime'] = time.time() - start_time
+    return summary
+
+
+def run_batch(scenarios, data="get_input_data_squirrel.json", output_dir="Scenarios",
+              processes=None, time_limit=None, memory_limit=None):
+    """Roster several scenarios concurrently in a process pool.
+
+    A scenario is a dict with a 'scenario_id' (also its directory under
+    output_dir) and optionally: 'data' (input json, default data),
+    'break_mode', 'backend', 'Quantity' / 'MinimumQuantity' overrides (see
+    apply_overrides), 'shift_lengths' ({hours: {"NBreaks", "NPeriods"}}),
+    'start_times' (hours), 'parameters' (dotted CPLEX parameters), and
+    'time_limit' (seconds) / 'memory_limit' (MB) replacing the batch ones.
+    Every scenario writes its outputs and run.log to its own directory;
+    Batch_Summary.csv in output_dir holds status, runtime and KPIs per scenario.
+    """
+    processes = processes or max(1, min(len(scenarios), os.cpu_count()))
+    threads = max(1, os.cpu_count() // processes)
+    print("Batch run: {0} scenarios over {1} processes".format(len(scenarios), processes))
+    rows = []
+    if scenarios:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(run_scenario, dict({'data': data}, **scenario),
+                                   os.path.join(output_dir, str(scenario['scenario_id'])),
+                                   time_limit, memory_limit, threads)
+                       for scenario in scenarios]
+            for future in futures:
+                rows.append(future.result())
+                print("Scenario {Scenario}: {Status} in {Runtime:.1f}s".format(**rows[-1]))
+    summary = pd.DataFrame(rows, columns=BATCH_SUMMARY_COLUMNS)
+    os.makedirs(output_dir, exist_ok=True)
+    summary.to_csv(os.path.join(output_dir, "Batch_Summary.csv"), index=False)
+    return summary
+
+
+class ResultCache:
+    """On-disk cache of output_squirrel.json contents keyed by SetupData.instance_hash.
+
+    Holds at most max_entries results (and max_bytes, if given); the least
+    recently used ones are evicted first.
+    """
+
+    def __init__(self, directory=".squirrel_cache", max_entries=64, max_bytes=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        "Cached records for key, or None"
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        with open(path, "r") as file:
+            return json.load(file)
+
+    def put(self, key, records):
+        path = self.path(key)
+        with open(path + ".tmp", "w") as file:
+            json.dump(records, file)
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def evict(self):
+        entries = sorted((os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                          if name.endswith(".json")), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in entries)
+        while entries and (len(entries) > self.max_entries or
+                           (self.max_bytes is not None and total > self.max_bytes)):
+            total -= os.path.getsize(entries[0])
+            os.remove(entries.pop(0))
 
 
 class ModelBuild:
 
-    def __init__(self, data, scenario_id):
+    def __init__(self, data, scenario_id, break_mode="periods", check_args=True, backend="cplex"):
         self.model = Model()
         self.model.start_time = time.time()
+        # Object times to roster (None keeps the first one only) and contacts
+        # left out of this run; set per partition by the decomposition mode
+        self.model.objecttime_ids = None
+        self.model.excluded_contacts = set()
+        # Hours and working days already rostered, set by the rolling horizon
+        self.model.carry_over = None
+        # "periods": continuous period variables, solver places the breaks
+        # "patterns": pick one precomputed break pattern per assigned shift
+        self.model.break_mode = break_mode
+        # False skips docplex argument checking when constraints are emitted
+        self.model.check_args = check_args
+        # "cplex": docplex model solved by CPLEX
+        # "cpsat": the "patterns" model solved by OR-Tools CP-SAT (CPSATRoster)
+        self.model.backend = backend
+        # Shift lengths ({hours: {"NBreaks", "NPeriods"}}) and start hours
+        # replacing the SetupData defaults, set per scenario by run_batch
+        self.model.shift_len_data = None
+        self.model.start_times = None
+        # Directory of the InputSnapshot cache of the input json (None disables it)
+        self.model.snapshot_dir = ".squirrel_snapshots"
         self.data = data
         self.scenario_id = scenario_id
 
-    def create_model_run(self):
-        self.Setup_Data = SetupData(self.data, self.model)
+    def settings(self, **overrides):
+        """Picklable copy of the run settings, to build the ModelBuild of a partition or window.
+
+        Holds the constructor arguments, shift_len_data, start_times (both also
+        used by the capacity check), snapshot_dir and the threads, timelimit and
+        mipgap solver parameters (None when left at their default); overrides
+        replace single entries.
+        """
+        parameters = self.model.parameters
+        settings = {
+            "break_mode": self.model.break_mode,
+            "check_args": self.model.check_args,
+            "backend": self.model.backend,
+            "shift_len_data": self.model.shift_len_data,
+            "start_times": self.model.start_times,
+            "snapshot_dir": self.model.snapshot_dir,
+            "threads": None if parameters.threads.is_default() else parameters.threads.get(),
+            "timelimit": None if parameters.timelimit.is_default() else parameters.timelimit.get(),
+            "mipgap": None if parameters.mip.tolerances.mipgap.is_default()
+            else parameters.mip.tolerances.mipgap.get(),
+        }
+        settings.update(overrides)
+        return settings
+
+    @classmethod
+    def from_settings(cls, data, scenario_id, settings):
+        "ModelBuild for data with the run settings of ModelBuild.settings"
+        mb = cls(data, scenario_id, settings["break_mode"], settings["check_args"], settings["backend"])
+        mb.model.shift_len_data = settings["shift_len_data"]
+        mb.model.start_times = settings["start_times"]
+        mb.model.snapshot_dir = settings["snapshot_dir"]
+        if settings["threads"] is not None:
+            mb.model.parameters.threads = settings["threads"]
+        if settings["timelimit"] is not None:
+            mb.model.parameters.timelimit = settings["timelimit"]
+        if settings["mipgap"] is not None:
+            mb.model.parameters.mip.tolerances.mipgap = settings["mipgap"]
+        return mb
+
+    def time_left(self):
+        "Seconds of the timelimit parameter left since the ModelBuild was created, None without a limit"
+        if self.model.parameters.timelimit.is_default():
+            return None
+        return max(0, self.model.parameters.timelimit.get() - (time.time() - self.model.start_time))
+
+    def create_model_run(self, warm_start=None, stream_incumbents=False, cache=None):
+        """Build, solve and write the results.
+
+        warm_start is a prior roster passed to CPLEX as a MIP start: a path to
+        output_squirrel.json / Squirrel_Shifts.csv, a Shift_Details DataFrame,
+        or "greedy" to start from the GreedyRoster heuristic. With
+        stream_incumbents every better incumbent is written while solving
+        (see IncumbentWriter). With a ResultCache, an instance solved before
+        is written from the cache without building or solving; on a miss the
+        SetupData (or CPSATRoster) hashed is the one built.
+        """
+        setup = None
+        if cache is not None:
+            if self.model.backend == "cpsat":
+                setup = CPSATRoster(self.data, self.model)
+            else:
+                setup = SetupData(self.data, self.model)
+            key = setup.instance_hash()
+            records = cache.get(key)
+            if records is not None:
+                print("Result cache hit {0}: skipping build and solve".format(key[:12]))
+                self.Create_Results = CreateResults(self.data, self.model, None)
+                self.Create_Results.load_records(records)
+                self.Create_Results.write_json()
+                return
+        if self.model.backend == "cpsat":
+            self.Create_Results = self.create_cpsat_results(setup)
+            if self.Create_Results is not None:
+                self.Create_Results.write_json()
+                if cache is not None:
+                    cache.put(key, self.Create_Results.output_records())
+            return
+        if isinstance(warm_start, str) and warm_start == "greedy":
+            warm_start = self.create_greedy_shifts()
+            # the greedy roster loaded the model objects again
+            setup = None
+        if setup is None:
+            setup = SetupData(self.data, self.model)
+        self.Setup_Data = setup
+        self.Setup_Data.capacity_check()
         self.Setup_Data.setup_data()
         print("1. Setting up Data: Done!")
         self.Setup_Constraints = SetupConstraints(self.data, self.model)
@@ -592,12 +2313,414 @@ class ModelBuild:
 
         print("3. Setting up Objectives: Done!")
         self.Model_Solve = ModelSolve(self.data, self.model)
-        self.solution = self.Model_Solve.solve_model()
+        self.solution = self.Model_Solve.solve_model(warm_start, stream_incumbents)
 
         print("4. Model solving: Done!")
         self.Create_Results = CreateResults(
             self.data, self.model, self.solution)
         self.Create_Results.create_results()
+        if cache is not None and self.solution:
+            cache.put(key, self.Create_Results.output_records())
+
+    def update_availability(self, added=(), removed=(), changed=(), time_limit=None):
+        """Re-roster the model built by create_model_run after a change of availabilities.
+
+        added and removed are Team_Member_Availability rows as in the input
+        json, changed is a list of (old row, new row) pairs. The shifts of
+        removed rows are fixed to 0, added rows get their candidate shifts,
+        constraints and on floor terms in the live model, and CPLEX restarts
+        from the previous roster (or solves from scratch when the last solve
+        found none). The results are written as by create_model_run.
+        """
+        if getattr(self, "Setup_Constraints", None) is None:
+            raise ValueError("update_availability needs the model built by create_model_run")
+        start_time = time.time()
+        removed = list(removed) + [old for old, _ in changed]
+        added = list(added) + [new for _, new in changed]
+        dropped = self.Setup_Data.remove_availabilities(
+            self.Setup_Data.read_availabilities(removed))
+        availabilities = [avail for avail in self.Setup_Data.read_availabilities(added)
+                          if self.model.guids[avail.contactid] not in self.model.excluded_contacts]
+        self.model.availabilities = self.model.availabilities + availabilities
+        VAR = self.Setup_Data.add_availabilities(availabilities)
+        if self.model.break_mode == "patterns":
+            self.Setup_Data.create_patterns(VAR)
+        else:
+            self.Setup_Data.create_periods(VAR)
+        self.Setup_Constraints.add_availability_constraints(VAR)
+        self.Setup_Data.capacity_check()
+        self.Setup_Objectives.update_objectives(VAR)
+        print("Availability update: {0} removed, {1} added in {2:.1f}s".format(
+            len(dropped), len(VAR), time.time() - start_time))
+        if time_limit is not None:
+            self.model.parameters.timelimit = time_limit
+        if self.solution:
+            self.solution = self.Model_Solve.solve_from(self.solution, dropped)
+        else:
+            self.model.clear_mip_starts()
+            self.solution = self.Model_Solve.solve_model()
+        self.Create_Results = CreateResults(
+            self.data, self.model, self.solution)
+        self.Create_Results.create_results()
+
+    def create_model_results(self):
+        "Build and solve the model; returns the CreateResults holding hourly profile and shifts, or None"
+        if self.model.backend == "cpsat":
+            return self.create_cpsat_results()
+        SetupData(self.data, self.model).setup_data()
+        SetupConstraints(self.data, self.model).add_constraints()
+        SetupObjectives(self.data, self.model).setup_objectives()
+        solution = ModelSolve(self.data, self.model).solve_model()
+        if not solution:
+            return None
+        results = CreateResults(self.data, self.model, solution)
+        results.collect_results()
+        return results
+
+    def create_cpsat_results(self, roster=None):
+        "Build and solve the \"patterns\" model with CPSATRoster (roster when given); returns its CreateResults, or None"
+        self.CPSAT_Roster = roster if roster is not None else CPSATRoster(self.data, self.model)
+        self.CPSAT_Roster.setup_data()
+        print("1. Setting up Data: Done!")
+        self.CPSAT_Roster.add_constraints()
+        print("2. Setting up Constraints and Objectives: Done!")
+        if self.CPSAT_Roster.solve_model() is None:
+            return None
+        print("3. Model solving: Done!")
+        return self.CPSAT_Roster.create_results()
+
+    def write_merged_results(self, hourly_profiles, shifts):
+        "Write the hourly profiles and shifts of several sub-solves as one output_squirrel.json"
+        self.Create_Results = CreateResults(self.data, self.model, None)
+        self.Create_Results.hourly_profile_df = pd.concat(
+            hourly_profiles, ignore_index=True)
+        self.Create_Results.shifts = pd.concat(shifts, ignore_index=True)
+        self.Create_Results.write_json()
+
+    def create_greedy_run(self):
+        "Roster with the GreedyRoster heuristic only (no solver) and write output_squirrel.json"
+        self.Greedy_Roster = GreedyRoster(self.data, self.model)
+        self.Greedy_Roster.setup_data()
+        self.Greedy_Roster.create_roster()
+        self.Create_Results = self.Greedy_Roster.create_results()
+        self.Create_Results.write_json()
+
+    def create_column_generation_run(self, start_step=0.25, max_iterations=50):
+        "Roster with ColumnGeneration and write output_squirrel.json"
+        self.Column_Generation = ColumnGeneration(
+            self.data, self.model, start_step, max_iterations)
+        self.solution = self.Column_Generation.solve_model()
+        if self.solution:
+            self.Create_Results = self.Column_Generation.create_results()
+            self.Create_Results.write_json()
+
+    def create_greedy_results(self):
+        "CreateResults of the GreedyRoster heuristic, without writing them"
+        greedy_roster = GreedyRoster(self.data, self.model)
+        greedy_roster.setup_data()
+        greedy_roster.create_roster()
+        return greedy_roster.create_results()
+
+    def create_greedy_shifts(self):
+        "Shift_Details of the GreedyRoster heuristic, without writing them"
+        return self.create_greedy_results().shifts
+
+    def get_partitions(self, partition):
+        "Group all object times by calendar day ('day') or one per object time ('objecttime')"
+        partitions = {}
+        for v in self.model.vacancy_objecttime.itertuples():
+            key = v.StartDateTime // 24 if partition == "day" else v.ObjectTimeID
+            partitions.setdefault(key, []).append(v.ObjectTimeID)
+        return partitions
+
+    def find_violations(self, shifts, partition_of, check_days):
+        """Coordination pass over the merged roster.
+
+        Walks every contact's shifts in time order and returns the
+        (partition, contactid) pairs to exclude so the cross-partition rules
+        hold: MaxHoursPerWeek per 7 days from the anchor date, at most
+        MaxConsecutiveShift consecutive working days and, when a day is split
+        over several partitions (check_days), one shift per day.
+        """
+        shift_constraints = self.model.shift_constraints[0]
+        roster = shifts.groupby("ShiftID").first().reset_index()
+        roster["Start"] = pd.to_datetime(roster["Shift_Start"])
+        roster["End"] = pd.to_datetime(roster["Shift_End"])
+        roster["Hours"] = (roster["End"] - roster["Start"]
+                           ).dt.total_seconds() / 3600
+        roster["Day"] = (roster["Start"] - self.model.anchor_date).dt.days
+        roster = roster.sort_values(["ContactID", "Start"])
+
+        violations = set()
+        for contactid, rows in roster.groupby("ContactID"):
+            week_hours = {}
+            last_day = None
+            run = 0
+            for row in rows.itertuples():
+                key = (partition_of[row.ObjectTimeID], contactid)
+                week = row.Day // 7
+                if check_days and row.Day == last_day:
+                    violations.add(key)
+                    continue
+                if week_hours.get(week, 0) + row.Hours > shift_constraints.MaxHoursPerWeek:
+                    violations.add(key)
+                    continue
+                if row.Day == last_day:
+                    new_run = run
+                elif last_day is not None and row.Day == last_day + 1:
+                    new_run = run + 1
+                else:
+                    new_run = 1
+                if new_run > shift_constraints.MaxConsecutiveShift:
+                    violations.add(key)
+                    continue
+                run = new_run
+                last_day = row.Day
+                week_hours[week] = week_hours.get(week, 0) + row.Hours
+        return violations
+
+    def create_model_run_decomposed(self, partition="day", processes=None):
+        """Solve the instance partition by partition in a process pool and merge the results.
+
+        Partitions are calendar days (or single object times). After every round
+        the merged roster goes through a coordination pass; contacts breaking a
+        cross-partition rule are excluded from the offending partition, which is
+        solved again, until the roster is valid. Exclusions only grow, so this
+        terminates. With a timelimit, every round gets half of the time left,
+        shared by the waves of partitions of that round; the other half is kept
+        for the coordination rounds after it. Partitions left without a solution
+        are reported and kept in skipped_partitions.
+        """
+        SetupData(self.data, self.model)
+        partitions = self.get_partitions(partition)
+        partition_of = {ot: key for key, ots in partitions.items() for ot in ots}
+        processes = processes or os.cpu_count()
+        threads = max(1, os.cpu_count() // processes)
+        print("Decomposed run: {0} partitions over {1} processes".format(
+            len(partitions), processes))
+
+        exclusions = {key: set() for key in partitions}
+        results = {}
+        pending = list(partitions)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            while pending:
+                settings = self.settings(threads=threads)
+                time_left = self.time_left()
+                if time_left is not None:
+                    waves = -(-len(pending) // processes)
+                    settings["timelimit"] = max(1, time_left / 2 / waves)
+                futures = [
+                    pool.submit(solve_partition, self.data, key, partitions[key], exclusions[key],
+                                settings)
+                    for key in pending
+                ]
+                for future in futures:
+                    key, hourly_profile_df, shifts = future.result()
+                    results[key] = (hourly_profile_df, shifts)
+                solved = [shifts for _, shifts in results.values()
+                          if shifts is not None]
+                if not solved:
+                    break
+                violations = self.find_violations(
+                    pd.concat(solved, ignore_index=True), partition_of, partition != "day")
+                violations = [(key, contactid) for key, contactid in violations
+                              if contactid not in exclusions[key]]
+                for key, contactid in violations:
+                    exclusions[key].add(contactid)
+                pending = sorted(set(key for key, _ in violations))
+                print("Coordination pass: {0} violations, re-solving {1} partitions".format(
+                    len(violations), len(pending)))
+
+        solved = [results[key] for key in sorted(results)
+                  if results[key][0] is not None]
+        if not solved:
+            print("No partition could be solved")
+            return
+        self.skipped_partitions = sorted(key for key in results if results[key][0] is None)
+        if self.skipped_partitions:
+            print("Decomposed run: no solution for partitions {0}, their object times "
+                  "are missing from the output".format(self.skipped_partitions))
+        self.write_merged_results([hourly_profile_df for hourly_profile_df, _ in solved],
+                                  [shifts for _, shifts in solved])
+
+    def create_model_run_rolling(self, window_days=7, freeze_days=1):
+        """Roster the whole vacancy window with a rolling horizon.
+
+        Solves the object times of window_days calendar days, keeps the shifts of
+        the first freeze_days days, carries their hours per week and working days
+        forward into the next window (see SetupConstraints.horizon_constraint)
+        and slides the window by freeze_days. Windows run with the settings of
+        this ModelBuild and, with a timelimit, an equal share of the time left.
+        The unfilled slack keeps every window feasible, so a window without a
+        solution ran out of time: its frozen days get the roster of
+        create_greedy_window instead and are reported at the end.
+        """
+        SetupData(self.data, self.model)
+        days = self.get_partitions("day")
+        carry_over = {"worked_days": {}, "week_hours": {}}
+        hourly_profiles = []
+        frozen_shifts = []
+        failed_days = []
+        start = min(days)
+        while start <= max(days):
+            window = [day for day in days if start <= day < start + window_days]
+            frozen_days = [day for day in window if day < start + freeze_days]
+            frozen = set(ot for day in frozen_days for ot in days[day])
+            start += freeze_days
+            if len(frozen) == 0:
+                continue
+            print("Rolling horizon: days {0} (freezing {1})".format(
+                window, frozen_days))
+
+            settings = self.settings()
+            time_left = self.time_left()
+            if time_left is not None:
+                windows = -(-(max(days) + 1 - frozen_days[0]) // freeze_days)
+                settings["timelimit"] = max(1, time_left / windows)
+            mb = ModelBuild.from_settings(self.data, self.scenario_id, settings)
+            mb.model.objecttime_ids = set(ot for day in window for ot in days[day])
+            mb.model.carry_over = carry_over
+            results = mb.create_model_results()
+            if results is None:
+                print("Rolling horizon: no solution for days {0}, "
+                      "greedy roster for days {1}".format(window, frozen_days))
+                failed_days.extend(frozen_days)
+                results = self.create_greedy_window(settings, frozen, frozen_shifts)
+
+            hourly_profiles.append(
+                results.hourly_profile_df[results.hourly_profile_df.ObjectTimeID.isin(frozen)])
+            shifts = results.shifts[results.shifts.ObjectTimeID.isin(frozen)]
+            frozen_shifts.append(shifts)
+            for row in shifts.groupby("ShiftID").first().itertuples():
+                shift_start = pd.to_datetime(row.Shift_Start)
+                hours = (pd.to_datetime(row.Shift_End) -
+                         shift_start).total_seconds() / 3600
+                day = (shift_start - self.model.anchor_date).days
+                carry_over["worked_days"].setdefault(
+                    row.ContactID, set()).add(day)
+                week_key = (row.ContactID, day // 7)
+                carry_over["week_hours"][week_key] = carry_over["week_hours"].get(
+                    week_key, 0) + hours
+
+        if failed_days:
+            print("Rolling horizon: days {0} have the greedy roster, their windows "
+                  "found no solution".format(failed_days))
+        self.write_merged_results(hourly_profiles, frozen_shifts)
+
+    def create_greedy_window(self, settings, objecttime_ids, frozen_shifts):
+        """CreateResults of the GreedyRoster over objecttime_ids, valid next to frozen_shifts.
+
+        Contacts whose greedy shifts break the cross-window rules of
+        find_violations (weekly hours, consecutive days) together with the
+        frozen shifts are excluded and the greedy roster is built again.
+        """
+        excluded = set()
+        while True:
+            mb = ModelBuild.from_settings(self.data, self.scenario_id, settings)
+            mb.model.objecttime_ids = set(objecttime_ids)
+            mb.model.excluded_contacts = set(excluded)
+            results = mb.create_greedy_results()
+            shifts = pd.concat(frozen_shifts + [results.shifts], ignore_index=True)
+            if len(shifts) == 0:
+                return results
+            partition_of = {ot: ot in objecttime_ids for ot in shifts.ObjectTimeID}
+            violations = set(contactid for in_window, contactid in
+                             self.find_violations(shifts, partition_of, False)
+                             if in_window) - excluded
+            if not violations:
+                return results
+            excluded |= violations
+
+    def create_model_run_lns(self, neighbourhood="day", size=1, iteration_time=30,
+                             iterations=100, time_limit=None, warm_start=None, seed=None,
+                             initial_time=None):
+        """Build the model, improve it with LNSSolve and write the results plus LNS_Log.csv.
+
+        The first solve runs for initial_time seconds, by default half of
+        time_limit, or iteration_time without a time_limit; the rest of
+        time_limit goes to the neighbourhood re-solves of iteration_time each.
+        """
+        if isinstance(warm_start, str) and warm_start == "greedy":
+            warm_start = self.create_greedy_shifts()
+        self.Setup_Data = SetupData(self.data, self.model)
+        self.Setup_Data.setup_data()
+        self.Setup_Constraints = SetupConstraints(self.data, self.model)
+        self.Setup_Constraints.add_constraints()
+        self.Setup_Objectives = SetupObjectives(self.data, self.model)
+        self.Setup_Objectives.setup_objectives()
+        self.Model_Solve = LNSSolve(self.data, self.model, neighbourhood, size,
+                                    iteration_time, iterations, time_limit, seed, initial_time)
+        self.solution = self.Model_Solve.solve_model(warm_start)
+        self.Create_Results = CreateResults(
+            self.data, self.model, self.solution)
+        self.Create_Results.create_results()
+        if self.solution:
+            pd.DataFrame(self.model.lns_log, columns=[
+                'Seconds', 'Iteration', 'Neighbourhood', 'Objective', 'Best_Objective']).to_csv('LNS_Log.csv')
+
+    def create_model_run_portfolio(self, portfolio=None, target_gap=0.1, time_limit=7200, threads=None):
+        """Race several CPLEX parameter sets on the same model and keep the best roster.
+
+        The built model is exported once to a SAV file and solved by one
+        process per parameter set (PORTFOLIO by default), each with its share
+        of the cores. Incumbents are printed as they are found; when one
+        worker reaches target_gap the others are stopped. The best values are
+        loaded back into the docplex model as a complete MIP start to write the
+        results.
+        """
+        portfolio = portfolio or PORTFOLIO
+        threads = threads or max(1, os.cpu_count() // len(portfolio))
+        SetupData(self.data, self.model).setup_data()
+        SetupConstraints(self.data, self.model).add_constraints()
+        SetupObjectives(self.data, self.model).setup_objectives()
+        path = os.path.join(tempfile.mkdtemp(), "squirrel.sav")
+        self.model.export_as_sav(path)
+
+        stop = multiprocessing.Event()
+        messages = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=solve_parameter_set, args=(
+            path, name, parameters, threads, time_limit, target_gap, stop, messages))
+            for name, parameters in portfolio.items()]
+        for worker in workers:
+            worker.start()
+        best = None
+        done = 0
+        while done < len(workers):
+            try:
+                message = messages.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers) and messages.empty():
+                    break
+                continue
+            if message[0] == "incumbent":
+                print("Portfolio {1}: incumbent {3} after {2:.1f}s (gap {4:.4f})".format(*message))
+                continue
+            done += 1
+            _, name, objective, gap, values = message
+            if objective is None:
+                print("Portfolio {0}: no solution {1}".format(name, values or ""))
+                continue
+            print("Portfolio {0}: finished with {1} (gap {2:.4f})".format(
+                name, objective, gap))
+            if best is None or objective < best[1]:
+                best = (name, objective, values)
+        for worker in workers:
+            worker.join()
+        os.remove(path)
+        if best is None:
+            print("No parameter set found a solution")
+            return
+
+        print("Portfolio: keeping {0} with objective {1}".format(best[0], best[1]))
+        start = self.model.new_solution(
+            {var: value for var, value in zip(self.model.iter_variables(), best[2])})
+        self.model.add_mip_start(start, effort_level=EffortLevel.CheckFeas,
+                                 write_level=WriteLevel.AllVars)
+        self.model.parameters.mip.limits.solutions = 1
+        self.solution = self.model.solve()
+        self.model.parameters.mip.limits.solutions.reset()
+        self.Create_Results = CreateResults(self.data, self.model, self.solution)
+        self.Create_Results.create_results()
 
 
 if __name__ == "__main__":